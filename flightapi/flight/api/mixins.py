@@ -0,0 +1,92 @@
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.http import Http404
+from flight.api.serializers import values_serializer
+from rest_framework.response import Response
+
+
+class QueryPlanMixin(object):
+    """
+    Apply the relations a viewset declares for each action to its queryset, and
+    on read-only actions load only the columns the serializer actually reads.
+    """
+    select_related = {}
+    prefetch_related = {}
+    pruned_actions = ('list', 'retrieve')
+
+    def get_queryset(self):
+        queryset = super(QueryPlanMixin, self).get_queryset()
+        if self.action in self.select_related:
+            queryset = queryset.select_related(*self.select_related[self.action])
+        if self.action in self.prefetch_related:
+            queryset = queryset.prefetch_related(*self.prefetch_related[self.action])
+        if self.action in self.pruned_actions:
+            columns = serializer_columns(self.get_serializer_class()(), queryset.model)
+            if columns:
+                queryset = queryset.only(*columns)
+        return queryset
+
+
+def serializer_columns(serializer, model, prefix=''):
+    """
+    Map serializer fields to model column lookups, following nested serializers
+    through their relation. Returns None when a field is not a plain model field.
+    """
+    columns = []
+    for field in serializer.fields.values():
+        if field.write_only:
+            continue
+        try:
+            model_field = model._meta.get_field(field.source)
+        except (FieldDoesNotExist, AttributeError):
+            return None
+        if model_field.many_to_many or model_field.one_to_many:
+            return None
+        if hasattr(field, 'fields'):
+            nested = serializer_columns(field, model_field.related_model, prefix + field.source + '__')
+            if nested is None:
+                return None
+            columns.extend(nested)
+        else:
+            columns.append(prefix + field.source)
+    return columns
+
+
+class ValuesReadMixin(object):
+    """
+    Serve the listed read actions through the compiled values() fast path
+    of the viewset's serializer instead of instantiating models.
+    """
+    values_actions = ('list', 'retrieve')
+
+    def get_values_serializer(self):
+        return values_serializer(self.get_serializer_class())
+
+    def list(self, request, *args, **kwargs):
+        if 'list' not in self.values_actions:
+            return super(ValuesReadMixin, self).list(request, *args, **kwargs)
+
+        reader = self.get_values_serializer()
+        queryset = reader.values(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(reader.many(page))
+        return Response(reader.many(queryset))
+
+    def retrieve(self, request, *args, **kwargs):
+        if 'retrieve' not in self.values_actions:
+            return super(ValuesReadMixin, self).retrieve(request, *args, **kwargs)
+
+        reader = self.get_values_serializer()
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            queryset = self.filter_queryset(self.get_queryset()).filter(
+                **{self.lookup_field: kwargs[lookup_url_kwarg]}
+            )
+        except (TypeError, ValueError, ValidationError):
+            # A lookup value of the wrong type names no row, as in get_object_or_404.
+            raise Http404
+        row = reader.values(queryset).first()
+        if row is None:
+            raise Http404
+        self.check_object_permissions(request, row)
+        return Response(reader.to_representation(row))
@@ -1,6 +1,10 @@
+from collections import OrderedDict
+from operator import itemgetter
+
+from djmoney.contrib.django_rest_framework import MoneyField
 from rest_framework import serializers
 
-from flight.models import Flight, Ticket
+from flight.models import Flight, FlightSchedule, Ticket
 
 
 class FlightSerializer(serializers.ModelSerializer):
@@ -8,8 +12,40 @@ class FlightSerializer(serializers.ModelSerializer):
         model = Flight
         fields = ('id', 'flight_number', 'arrival_location',
                   'departure_location', 'arrival_time', 'departure_time',
-                  'status', 'arrival_date', 'departure_date'
+                  'status', 'arrival_date', 'departure_date',
+                  'capacity', 'seats_remaining'
                   )
+        read_only_fields = ('seats_remaining',)
+
+
+class FlightImportSerializer(FlightSerializer):
+    price = serializers.DecimalField(max_digits=14, decimal_places=2)
+    price_currency = serializers.CharField(max_length=3, required=False)
+
+    class Meta(FlightSerializer.Meta):
+        fields = FlightSerializer.Meta.fields + ('price', 'price_currency')
+
+
+class FlightScheduleSerializer(serializers.ModelSerializer):
+    price = MoneyField(max_digits=14, decimal_places=2)
+    price_currency = serializers.CharField(max_length=3, required=False)
+
+    class Meta:
+        model = FlightSchedule
+        fields = ('id', 'flight_number', 'departure_location', 'arrival_location',
+                  'departure_time', 'arrival_time', 'arrival_day_offset', 'days_of_week',
+                  'valid_from', 'valid_until', 'price', 'price_currency', 'capacity'
+                  )
+
+    def validate_days_of_week(self, value):
+        return ''.join(sorted(value))
+
+    def validate(self, data):
+        valid_from = data.get('valid_from', getattr(self.instance, 'valid_from', None))
+        valid_until = data.get('valid_until', getattr(self.instance, 'valid_until', None))
+        if valid_until is not None and valid_until < valid_from:
+            raise serializers.ValidationError('valid_until cannot be before valid_from')
+        return data
 
 
 class RestrictedFlightSerializer(serializers.ModelSerializer):
@@ -27,3 +63,82 @@ class TicketSerializer(serializers.ModelSerializer):
                   'departure_location', 'arrival_time', 'departure_time',
                   'arrival_date', 'departure_location', 'departure_date'
                   )
+
+
+# Fields whose to_representation() returns database values unchanged
+IDENTITY_FIELDS = (
+    serializers.CharField,
+    serializers.ChoiceField,
+    serializers.IntegerField,
+    serializers.BooleanField,
+    serializers.PrimaryKeyRelatedField,
+)
+
+
+class ValuesSerializer(object):
+    """
+    Read-only fast path for a ModelSerializer.
+
+    Rows come straight from queryset.values() and are mapped to the same JSON
+    shape through field accessors compiled once per serializer class, so no
+    model instances or per-row serializer objects are created.
+    """
+
+    def __init__(self, serializer_class):
+        serializer = serializer_class()
+        self.columns = []
+        self.accessors = self.compile(serializer, serializer.Meta.model, '')
+
+    def compile(self, serializer, model, prefix):
+        accessors = []
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            column = prefix + field.source
+            self.columns.append(column)
+            if hasattr(field, 'fields'):
+                related_model = model._meta.get_field(field.source).related_model
+                nested = self.compile(field, related_model, column + '__')
+                accessors.append((name, nested_accessor(column, nested)))
+            elif isinstance(field, IDENTITY_FIELDS):
+                accessors.append((name, itemgetter(column)))
+            else:
+                accessors.append((name, converted_accessor(column, field.to_representation)))
+        return accessors
+
+    def to_representation(self, row):
+        return OrderedDict([(name, accessor(row)) for name, accessor in self.accessors])
+
+    def many(self, rows):
+        to_representation = self.to_representation
+        return [to_representation(row) for row in rows]
+
+    def values(self, queryset):
+        return queryset.values(*self.columns)
+
+
+def converted_accessor(column, to_representation):
+    def accessor(row):
+        value = row[column]
+        return None if value is None else to_representation(value)
+    return accessor
+
+
+def nested_accessor(column, accessors):
+    def accessor(row):
+        if row[column] is None:
+            return None
+        return OrderedDict([(name, nested(row)) for name, nested in accessors])
+    return accessor
+
+
+_values_serializers = {}
+
+
+def values_serializer(serializer_class):
+    """
+    Get the compiled ValuesSerializer for a ModelSerializer class.
+    """
+    if serializer_class not in _values_serializers:
+        _values_serializers[serializer_class] = ValuesSerializer(serializer_class)
+    return _values_serializers[serializer_class]
@@ -1,18 +1,31 @@
+from collections import OrderedDict
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import Http404
 from django.shortcuts import get_object_or_404
-from flight.api.serializers import FlightSerializer, TicketSerializer
-from flight.models import Flight, Ticket
+from flight import cache as flight_cache
+from flight.api.mixins import QueryPlanMixin, ValuesReadMixin
+from flight.api.serializers import FlightScheduleSerializer, FlightSerializer, TicketSerializer
+from flight.conditional import built_validators, changed_validators, conditional, list_validators, row_validators
+from flight.decorators import idempotent
+from flight.dispatch import metrics as dispatch_metrics
+from flight.importer import FlightImporter
+from flight.local_cache import local_cache, worker_stats
+from flight.models import Flight, FlightSchedule, Ticket
 from flight.permissions import IsOwner
-from flight.tasks import (notify_user_on_confirmed_ticket,
-                          notify_user_on_reservation)
-from flight.utils import convert_date_to_unix
+from flight.utils import day_bounds, parse_query_date
+from flightapi.pagination import FlightSearchCursorPagination
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
 from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.views import APIView
 
 # Create your views here.
 
-class FlightViewSet(viewsets.ModelViewSet):
+class FlightViewSet(ValuesReadMixin, QueryPlanMixin, viewsets.ModelViewSet):
     queryset = Flight.objects.all()
     serializer_class = FlightSerializer
 
@@ -22,10 +35,35 @@ class FlightViewSet(viewsets.ModelViewSet):
         """
         permission_classes = [IsAuthenticated, ]
         if self.action in ('create', 'destroy', 'update',
-                           'partial_update', 'flight_status'):
+                           'partial_update', 'flight_status', 'bulk'):
             permission_classes = [IsAdminUser]
         return [permission() for permission in permission_classes]
 
+    def list(self, request, *args, **kwargs):
+        key = flight_cache.query_key(request)
+
+        def build():
+            etag, last_modified = built_validators('flights', key)
+            data = super(FlightViewSet, self).list(request, *args, **kwargs).data
+            return dict(data=data, etag=etag, last_modified=last_modified)
+
+        page = flight_cache.get_or_build(flight_cache.LIST_SCOPE, key, build)
+        return conditional(request, page['etag'], page['last_modified'], lambda: Response(page['data']))
+
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            flight_id = int(kwargs['pk'])
+        except ValueError:
+            raise Http404
+
+        def build():
+            etag, last_modified = built_validators('flight', flight_id)
+            data = super(FlightViewSet, self).retrieve(request, *args, **kwargs).data
+            return dict(data=data, etag=etag, last_modified=last_modified)
+
+        flight = flight_cache.get_or_build(flight_id, 'detail', build)
+        return conditional(request, flight['etag'], flight['last_modified'], lambda: Response(flight['data']))
+
     @action(detail=True, methods=['patch'])
     def flight_status(self, request, pk=None):
         status = request.data.get('status')
@@ -45,7 +83,82 @@ class FlightViewSet(viewsets.ModelViewSet):
         serializer = FlightSerializer(flight)
         return Response(serializer.data, status=200)
 
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """
+        Create up to FLIGHT_BULK_CREATE_MAX_ROWS flights in one request. Invalid rows
+        are reported by their index and do not stop the valid ones being created.
+        """
+        if not isinstance(request.data, list):
+            response = dict(message="Expected a list of flights")
+            return Response(response, status=status.HTTP_400_BAD_REQUEST)
+        if len(request.data) > settings.FLIGHT_BULK_CREATE_MAX_ROWS:
+            response = dict(message="At most {} flights can be created at once".format(
+                settings.FLIGHT_BULK_CREATE_MAX_ROWS))
+            return Response(response, status=status.HTTP_400_BAD_REQUEST)
+
+        errors = []
+        importer = FlightImporter(
+            settings.FLIGHT_BULK_CREATE_MAX_ROWS, lambda index, detail: errors.append(dict(index=index, errors=detail))
+        )
+        created = importer.run(enumerate(request.data))
+
+        if not errors:
+            response_status = status.HTTP_201_CREATED
+        elif created:
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_400_BAD_REQUEST
+        return Response(dict(created=created, errors=errors), status=response_status)
+
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """
+        Search flights on a route within a departure date range.
+        """
+        departure_location = request.query_params.get('departure_location')
+        arrival_location = request.query_params.get('arrival_location')
+        if not departure_location or not arrival_location:
+            response = dict(message="departure_location and arrival_location are required")
+            return Response(response, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            date_from = parse_query_date(request.query_params.get('departure_date_from'))
+            date_to = parse_query_date(request.query_params.get('departure_date_to'))
+        except ValueError:
+            response = dict(message="departure dates must be in the format YYYY-MM-DD")
+            return Response(response, status=status.HTTP_400_BAD_REQUEST)
+
+        flight_status = request.query_params.get('status')
+        if flight_status and flight_status not in Flight.STATUSES:
+            response = dict(message="flight status is incorrect")
+            return Response(response, status=status.HTTP_400_BAD_REQUEST)
+
+        # The cursor needs a departure date to page on
+        queryset = Flight.objects.filter(
+            departure_location=departure_location,
+            arrival_location=arrival_location,
+            departure_date__isnull=False,
+        )
+        if date_from:
+            queryset = queryset.filter(departure_date__gte=date_from)
+        if date_to:
+            queryset = queryset.filter(departure_date__lte=date_to)
+        if flight_status:
+            queryset = queryset.filter(status=flight_status)
+
+        reader = self.get_values_serializer()
+
+        def build():
+            paginator = FlightSearchCursorPagination()
+            page = paginator.paginate_queryset(reader.values(queryset), request, view=self)
+            return paginator.get_paginated_response(reader.many(page)).data
+
+        data = flight_cache.get_or_build(flight_cache.LIST_SCOPE, flight_cache.query_key(request), build)
+        return Response(data, status=status.HTTP_200_OK)
+
     @action(detail=True, methods=['post'])
+    @idempotent
     def reserve(self, request, pk=None):
         user = request.user
         try:
@@ -57,79 +170,144 @@ class FlightViewSet(viewsets.ModelViewSet):
         if Ticket.objects.filter(user=user, flight=flight).exists():
             return Response(dict(message="Ticket already exist for this flight"), status=409)
 
-        ticket = Ticket.objects.create(
-            user=user,
-            flight=flight,
-            arrival_time=flight.arrival_time,
-            arrival_date=flight.arrival_date,
-            departure_time=flight.departure_time,
-            departure_date=flight.departure_date,
-            departure_location=flight.departure_location,
-            arrival_location=flight.arrival_location
-        )
-        ticket.save()
-        notify_user_on_reservation.delay(
-            ticket.pk
-        )
+        try:
+            ticket = self.issue_ticket(user, flight, Ticket.RESERVED)
+        except IntegrityError:
+            return Response(dict(message="Ticket already exist for this flight"), status=409)
+        if ticket is None:
+            return Response(dict(message="This flight is sold out"), status=status.HTTP_409_CONFLICT)
+
         serializer = TicketSerializer(ticket)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     @action(detail=True, methods=['post'])
+    @idempotent
     def book(self, request, pk=None):
         queryset = Flight.objects.all()
         flight = get_object_or_404(queryset, pk=pk)
-        ticket = Ticket.objects.filter(user=request.user, flight=flight).exclude(
-            status__in=(
-                Ticket.RESERVED
-            ))
-        if ticket.exists():
+        ticket = Ticket.objects.filter(user=request.user, flight=flight).first()
+        if ticket and ticket.status != Ticket.RESERVED:
             response = dict(
                 message="This flight has either being booked or confirmed"
             )
             return Response(response, status=400)
 
-        ticket = Ticket.objects.create(
-            user=request.user,
-            flight=flight,
-            arrival_time=flight.arrival_time,
-            arrival_date=flight.arrival_date,
-            departure_time=flight.departure_time,
-            departure_date=flight.departure_date,
-            departure_location=flight.departure_location,
-            arrival_location=flight.arrival_location,
-            status=Ticket.BOOKED
-        )
-        ticket.save()
+        if ticket:
+            # A reservation already holds a seat, so booking only moves it on.
+            ticket.status = Ticket.BOOKED
+            ticket.save()
+            serializer = TicketSerializer(ticket)
+            return Response(serializer.data, status=status.HTTP_200_OK)
+
+        try:
+            ticket = self.issue_ticket(request.user, flight, Ticket.BOOKED)
+        except IntegrityError:
+            response = dict(
+                message="This flight has either being booked or confirmed"
+            )
+            return Response(response, status=400)
+        if ticket is None:
+            return Response(dict(message="This flight is sold out"), status=status.HTTP_409_CONFLICT)
+
         serializer = TicketSerializer(ticket)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+    def issue_ticket(self, user, flight, ticket_status):
+        """
+        Create a ticket and take its seat in one transaction.
+        The seat is taken last so the flight row stays locked only until commit.
+        Returns None when the flight is sold out.
+        """
+        with transaction.atomic():
+            ticket = Ticket.objects.create(
+                user=user,
+                flight=flight,
+                arrival_time=flight.arrival_time,
+                arrival_date=flight.arrival_date,
+                departure_time=flight.departure_time,
+                departure_date=flight.departure_date,
+                departure_location=flight.departure_location,
+                arrival_location=flight.arrival_location,
+                status=ticket_status
+            )
+            if not Flight.objects.take_seat(flight.pk):
+                transaction.set_rollback(True)
+                return None
+        return ticket
+
     @action(detail=True, methods=['get'], url_path='reserved/(?P<date>[0-9_-]+)')
     def reserved(self, request, pk=None, date=None):
         queryset = Flight.objects.all()
         flight = get_object_or_404(queryset, pk=pk)
 
-        reserved_tickets = flight.tickets.filter(
+        try:
+            day_start, day_end = day_bounds(parse_query_date(date))
+        except ValueError:
+            response = dict(message="date must be in the format YYYY-MM-DD")
+            return Response(response, status=status.HTTP_400_BAD_REQUEST)
+
+        tickets = flight.tickets.filter(
             status=Ticket.CONFIRMED,
-        )
-        date_to_timestamp = convert_date_to_unix(date)
-        tickets = [
-            ticket for ticket in reserved_tickets
-            if convert_date_to_unix(ticket.confirmed_from.strftime('%Y-%m-%d')) == date_to_timestamp
-        ]
+            confirmed_from__gte=day_start,
+            confirmed_from__lt=day_end,
+        ).select_related('flight')
+
+        counter = flight.reservation_counters.filter(
+            date=day_start.date(), status=Ticket.CONFIRMED
+        ).values_list('count', flat=True).first()
 
         serializer = TicketSerializer(tickets, many=True)
         response = {
             "reservations": serializer.data,
-            "reservations_count": len(tickets)
+            "reservations_count": counter or 0
+        }
+        return Response(response, status=status.HTTP_200_OK)
+
+    @action(detail=True, methods=['get'])
+    def reservation_counts(self, request, pk=None):
+        """
+        Read confirmed tickets per day over a date range from the reservation counters.
+        """
+        queryset = Flight.objects.all()
+        flight = get_object_or_404(queryset, pk=pk)
+
+        try:
+            date_from = parse_query_date(request.query_params.get('date_from'))
+            date_to = parse_query_date(request.query_params.get('date_to'))
+        except ValueError:
+            response = dict(message="dates must be in the format YYYY-MM-DD")
+            return Response(response, status=status.HTTP_400_BAD_REQUEST)
+
+        if not date_from or not date_to or date_from > date_to:
+            response = dict(message="A valid date_from and date_to range is required")
+            return Response(response, status=status.HTTP_400_BAD_REQUEST)
+
+        counts = flight.reservation_counters.filter(
+            status=Ticket.CONFIRMED,
+            date__gte=date_from,
+            date__lte=date_to,
+            count__gt=0,
+        ).values_list('date', 'count').order_by('date')
+
+        response = {
+            "reservations": [
+                dict(date=date.isoformat(), count=count) for date, count in counts
+            ],
         }
         return Response(response, status=status.HTTP_200_OK)
 
-class TicketViewSet(viewsets.ModelViewSet):
+class TicketViewSet(ValuesReadMixin, QueryPlanMixin, viewsets.ModelViewSet):
     """
         Set and get permissions for the ticket view.
     """
     queryset = Ticket.objects.all()
     serializer_class = TicketSerializer
+    # retrieve stays on the model path because IsOwner checks the ticket instance
+    values_actions = ('list',)
+    select_related = {
+        'list': ('flight',),
+        'retrieve': ('flight',),
+    }
 
     def get_permissions(self):
         permission_classes = [IsAuthenticated, ]
@@ -139,6 +317,114 @@ class TicketViewSet(viewsets.ModelViewSet):
             permission_classes = [IsOwner]
         return [permission() for permission in permission_classes]
 
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            instance.delete()
+            Flight.objects.release_seat(instance.flight_id)
+
+    def list(self, request, *args, **kwargs):
+        etag, last_modified = changed_validators(
+            'tickets', flight_cache.query_key(request), flight_cache.TICKET_LIST_SCOPE, flight_cache.LIST_SCOPE
+        )
+        return conditional(request, etag, last_modified,
+                           lambda: super(TicketViewSet, self).list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        """
+        Answer polls from the ticket's and its flight's updated_at before loading
+        or serializing the ticket. Anything but the owner's existing ticket takes
+        the regular path for its 404 or permission error.
+        """
+        try:
+            validators = Ticket.objects.filter(pk=kwargs['pk']).values_list(
+                'user_id', 'updated_at', 'flight__updated_at').first()
+        except ValueError:
+            validators = None
+        if validators is None or validators[0] != request.user.pk:
+            return super(TicketViewSet, self).retrieve(request, *args, **kwargs)
+
+        etag, last_modified = row_validators('ticket', kwargs['pk'], *validators[1:])
+        return conditional(request, etag, last_modified,
+                           lambda: super(TicketViewSet, self).retrieve(request, *args, **kwargs))
+
+    @action(detail=False, methods=['get'])
+    def mine(self, request):
+        """
+        Page through the current user's tickets, optionally filtered by status
+        and departure date range, with each ticket's flight joined in.
+        """
+        try:
+            date_from = parse_query_date(request.query_params.get('departure_date_from'))
+            date_to = parse_query_date(request.query_params.get('departure_date_to'))
+        except ValueError:
+            response = dict(message="departure dates must be in the format YYYY-MM-DD")
+            return Response(response, status=status.HTTP_400_BAD_REQUEST)
+
+        ticket_status = request.query_params.get('status')
+        if ticket_status and ticket_status not in dict(Ticket.STATUS):
+            response = dict(message="ticket status is incorrect")
+            return Response(response, status=status.HTTP_400_BAD_REQUEST)
+
+        queryset = Ticket.objects.filter(user=request.user)
+        if ticket_status:
+            queryset = queryset.filter(status=ticket_status)
+        if date_from:
+            queryset = queryset.filter(departure_date__gte=date_from)
+        if date_to:
+            queryset = queryset.filter(departure_date__lte=date_to)
+
+        def respond():
+            reader = self.get_values_serializer()
+            page = self.paginate_queryset(reader.values(queryset))
+            return self.get_paginated_response(reader.many(page))
+
+        etag, last_modified = list_validators('tickets', queryset, 'updated_at', 'flight__updated_at')
+        return conditional(request, etag, last_modified, respond)
+
+    @action(detail=False, methods=['get'])
+    def batch(self, request):
+        """
+        Retrieve several of the caller's tickets from one ownership-scoped query.
+        Results follow the order of ?ids=; ids that are unknown or belong to someone
+        else are reported per item as not found.
+        """
+        try:
+            ticket_ids = [int(ticket_id) for ticket_id in request.query_params.get('ids', '').split(',')]
+        except ValueError:
+            response = dict(message="ids must be a comma separated list of ticket ids")
+            return Response(response, status=status.HTTP_400_BAD_REQUEST)
+
+        ticket_ids = list(OrderedDict.fromkeys(ticket_ids))
+        if len(ticket_ids) > settings.TICKET_BATCH_MAX_IDS:
+            response = dict(message="At most {} tickets can be retrieved at once".format(
+                settings.TICKET_BATCH_MAX_IDS))
+            return Response(response, status=status.HTTP_400_BAD_REQUEST)
+
+        reader = self.get_values_serializer()
+        rows = reader.values(Ticket.objects.filter(user=request.user, id__in=ticket_ids))
+        tickets = {row['id']: reader.to_representation(row) for row in rows}
+
+        results = []
+        for ticket_id in ticket_ids:
+            if ticket_id in tickets:
+                results.append(dict(id=ticket_id, status=status.HTTP_200_OK, ticket=tickets[ticket_id]))
+            else:
+                results.append(dict(id=ticket_id, status=status.HTTP_404_NOT_FOUND, message="Ticket not found"))
+        return Response(dict(results=results), status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['get'], url_path='by-reference/(?P<reference>[0-9A-Za-z]+)')
+    def by_reference(self, request, reference=None):
+        """
+        Look a ticket up by its booking reference through the unique reference index.
+        Tickets belonging to someone else are reported as not found unless the caller is staff.
+        """
+        queryset = Ticket.objects.select_related('flight')
+        ticket = get_object_or_404(queryset, booking_reference=reference.upper())
+        if ticket.user_id != request.user.pk and not request.user.is_staff:
+            raise Http404
+        serializer = TicketSerializer(ticket)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
     @action(detail=True, methods=['patch'])
     def book(self, request, pk=None):
         queryset = Ticket.objects.all()
@@ -158,6 +444,7 @@ class TicketViewSet(viewsets.ModelViewSet):
         return Response(serializer.data, status=status.HTTP_200_OK)
 
     @action(detail=True, methods=['post'])
+    @idempotent
     def purchase(self, request, pk=None):
         current_user = request.user
         queryset = Ticket.objects.all()
@@ -170,12 +457,6 @@ class TicketViewSet(viewsets.ModelViewSet):
         if ticket.status == Ticket.BOOKED:
             ticket.status = Ticket.CONFIRMED
             ticket.save()
-            notify_user_on_confirmed_ticket.delay(
-                ticket.pk
-            )
-            notify_user_on_confirmed_ticket.delay(
-                ticket.pk
-            )
             serializer = TicketSerializer(ticket)
             return Response(serializer.data, status=status.HTTP_200_OK)
         return Response(dict(message="Ticket has been purchased for this flight"), status=400)
@@ -208,3 +489,53 @@ class TicketViewSet(viewsets.ModelViewSet):
 
         response = dict(message="Some of the fields provided are not permitted for this action")
         return Response(response, status=400)
+
+
+class FlightScheduleViewSet(viewsets.ModelViewSet):
+    """
+    Recurring flight schedules. Creating or editing one fills in its flights up
+    to FLIGHT_SCHEDULE_HORIZON_DAYS ahead; flights already generated are left as
+    they are, since they may have tickets.
+    """
+    queryset = FlightSchedule.objects.all()
+    serializer_class = FlightScheduleSerializer
+    permission_classes = [IsAdminUser]
+
+    def perform_create(self, serializer):
+        self.generate_flights(serializer.save())
+
+    def perform_update(self, serializer):
+        self.generate_flights(serializer.save())
+
+    def generate_flights(self, schedule):
+        today = date.today()
+        FlightSchedule.objects.generate(
+            today, today + timedelta(days=settings.FLIGHT_SCHEDULE_HORIZON_DAYS),
+            FlightSchedule.objects.filter(pk=schedule.pk)
+        )
+
+
+class DispatchMetricsView(APIView):
+    """
+    Report how long notification dispatch spends on the request thread, per mode.
+    """
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        return Response(dispatch_metrics.snapshot(), status=status.HTTP_200_OK)
+
+
+class FlightCacheMetricsView(APIView):
+    """
+    Report shared flight cache hits, misses and coalesced misses, along with the
+    in-process LRU hit ratio of the answering worker and of every live worker.
+    """
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        response = dict(
+            shared=flight_cache.stats(),
+            worker=local_cache().stats(),
+            workers=worker_stats(),
+        )
+        return Response(response, status=status.HTTP_200_OK)
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class FlightConfig(AppConfig):
     name = 'flight'
+
+    def ready(self):
+        import flight.signals  # noqa: F401
@@ -0,0 +1,138 @@
+import hashlib
+import time
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from flight.local_cache import local_cache, publish_invalidation
+
+LIST_SCOPE = 'list'
+TICKET_LIST_SCOPE = 'ticket-list'
+# Scopes that also record when they last changed, for list validators
+TIMED_SCOPES = (LIST_SCOPE, TICKET_LIST_SCOPE)
+COUNTERS = ('hits', 'misses', 'coalesced')
+
+
+def generation_key(scope):
+    return 'flight-cache:generation:{}'.format(scope)
+
+
+def counter_key(name):
+    return 'flight-cache:{}'.format(name)
+
+
+def changed_key(scope):
+    return 'flight-cache:changed:{}'.format(scope)
+
+
+def query_key(request):
+    " A per-query cache key for the request's full URL "
+    return hashlib.md5(request.build_absolute_uri().encode()).hexdigest()
+
+
+def get_or_build(scope, key, build):
+    """
+    Return the payload for key within scope from this worker's LRU, falling back
+    to the shared cache and then to building it.
+    """
+    local = local_cache()
+    local_generation = local.generation(scope)
+    payload = local.get(scope, key)
+    if payload is None:
+        payload = get_or_build_shared(scope, key, build)
+        local.set(scope, key, payload, local_generation)
+    return payload
+
+
+def get_or_build_shared(scope, key, build):
+    """
+    Return the shared cached payload for key within scope, building it on a miss.
+
+    Keys embed the scope's current generation, so invalidating a scope is a single
+    increment and a payload built from data read before the increment is never
+    served afterwards. On a miss one request takes a short lock and builds the
+    payload; concurrent misses wait up to FLIGHT_CACHE_MAX_WAIT for it and then
+    build it themselves rather than hold the request any longer.
+    """
+    generation = cache.get(generation_key(scope), 0)
+    data_key = 'flight-cache:{}:{}:{}'.format(scope, generation, key)
+    payload = cache.get(data_key)
+    if payload is not None:
+        count('hits')
+        return payload
+
+    count('misses')
+    lock_key = data_key + ':lock'
+    if cache.add(lock_key, 1, settings.FLIGHT_CACHE_LOCK_TIMEOUT):
+        try:
+            payload = build()
+            cache.set(data_key, payload, settings.FLIGHT_CACHE_TTL)
+        finally:
+            cache.delete(lock_key)
+        return payload
+
+    deadline = time.monotonic() + settings.FLIGHT_CACHE_MAX_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(settings.FLIGHT_CACHE_POLL_INTERVAL)
+        payload = cache.get(data_key)
+        if payload is not None:
+            count('coalesced')
+            return payload
+    # The builder is slow or died; build it here, keeping its payload if it lands first.
+    payload = build()
+    cache.add(data_key, payload, settings.FLIGHT_CACHE_TTL)
+    return payload
+
+
+def invalidate(*scopes):
+    """
+    Move each scope to a new generation now and again once the transaction
+    commits, so a request reading before the commit cannot cache stale data.
+    """
+    bump_generations(scopes)
+    transaction.on_commit(lambda: bump_generations(scopes))
+
+
+def invalidate_flight(flight_id):
+    invalidate(flight_id, LIST_SCOPE)
+
+
+def bump_generations(scopes):
+    for scope in scopes:
+        increment(generation_key(scope))
+        if scope in TIMED_SCOPES:
+            cache.set(changed_key(scope), time.time(), None)
+        publish_invalidation(scope)
+
+
+def last_changed(*scopes):
+    """
+    When each scope was last invalidated, as UTC datetimes. A scope with no
+    record, say after an eviction, counts as changed now.
+    """
+    keys = [changed_key(scope) for scope in scopes]
+    values = cache.get_many(keys)
+    for key in keys:
+        if key not in values:
+            cache.add(key, time.time(), None)
+            values[key] = cache.get(key, time.time())
+    return [datetime.fromtimestamp(values[key], tz=timezone.utc) for key in keys]
+
+
+def count(name):
+    increment(counter_key(name))
+
+
+def increment(key):
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Evicted between add and incr
+        cache.set(key, 1, None)
+
+
+def stats():
+    values = cache.get_many([counter_key(name) for name in COUNTERS])
+    return {name: values.get(counter_key(name), 0) for name in COUNTERS}
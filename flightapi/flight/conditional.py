@@ -0,0 +1,66 @@
+from datetime import datetime, timezone
+
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from flight import cache as flight_cache
+
+
+def microseconds(value):
+    return int(value.timestamp() * 1000000) if value else 0
+
+
+def row_validators(kind, pk, *timestamps):
+    """
+    A strong ETag and Last-Modified time for one row from its updated_at values.
+    Pass the updated_at of every related row the representation embeds.
+    """
+    last_modified = max((value for value in timestamps if value), default=None)
+    etag = quote_etag('{}-{}-{}'.format(kind, pk, '-'.join(str(microseconds(value)) for value in timestamps)))
+    return etag, last_modified
+
+
+def list_validators(kind, queryset, *timestamp_fields):
+    """
+    Validators for a list from one aggregate query: the row count catches
+    deletions and the newest updated_at catches inserts and updates.
+    """
+    aggregates = queryset.order_by().aggregate(
+        rows=Count('pk'), **{'max_{}'.format(i): Max(field) for i, field in enumerate(timestamp_fields)}
+    )
+    timestamps = [aggregates['max_{}'.format(i)] for i in range(len(timestamp_fields))]
+    return row_validators(kind, aggregates['rows'], *timestamps)
+
+
+def built_validators(kind, key):
+    """
+    Validators for a payload built now. Store them with the cached payload: it is
+    rebuilt whenever its scope is invalidated, so a hit needs no query to validate.
+    """
+    built_at = datetime.now(tz=timezone.utc)
+    return row_validators(kind, key, built_at)
+
+
+def changed_validators(kind, key, *scopes):
+    """
+    Validators for a list from when the cache scopes it depends on last changed,
+    read from the cache instead of aggregating over the table.
+    """
+    return row_validators(kind, key, *flight_cache.last_changed(*scopes))
+
+
+def conditional(request, etag, last_modified, respond):
+    """
+    Answer 304 Not Modified when the client's If-None-Match / If-Modified-Since
+    validators still hold, without calling respond(). Otherwise return respond()'s
+    response with the validators attached.
+    """
+    last_modified = int(last_modified.timestamp()) if last_modified else None
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = respond()
+    if response.status_code in (200, 304):
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+    return response
@@ -0,0 +1,94 @@
+import json
+from datetime import datetime, timezone
+from functools import wraps
+
+from django.db import IntegrityError, transaction
+from flight.models import IdempotencyKey
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+
+def idempotent(view_method):
+    """
+    Replay the stored response when a request repeats an Idempotency-Key.
+
+    The key row is inserted in the same transaction as the wrapped action, so a
+    concurrent duplicate blocks on the unique (user, key) index until the first
+    request commits and then replays its response instead of racing it.
+    """
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.META.get('HTTP_IDEMPOTENCY_KEY')
+        if not key:
+            return view_method(self, request, *args, **kwargs)
+
+        if len(key) > 255:
+            response = dict(message="Idempotency-Key cannot be longer than 255 characters")
+            return Response(response, status=status.HTTP_400_BAD_REQUEST)
+
+        with transaction.atomic():
+            record = claim_key(request, key)
+            if record.response_status is not None:
+                return replay(request, record)
+
+            response = view_method(self, request, *args, **kwargs)
+            record.response_status = response.status_code
+            record.response_body = json.dumps(response.data, cls=JSONEncoder)
+            record.save(update_fields=['response_status', 'response_body'])
+        return response
+    return wrapper
+
+
+def claim_key(request, key):
+    try:
+        with transaction.atomic():
+            return IdempotencyKey.objects.create(
+                key=key,
+                user=request.user,
+                request_method=request.method,
+                request_path=request.path
+            )
+    except IntegrityError:
+        record = IdempotencyKey.objects.get(user=request.user, key=key)
+
+    if record.is_expired:
+        return reclaim_key(request, record)
+    return record
+
+
+def reclaim_key(request, record):
+    """
+    Take over an expired key row in place with one conditional UPDATE. When a
+    concurrent retry reclaimed it first, wait on its row lock and use its record.
+    """
+    claimed_at = datetime.now(tz=timezone.utc)
+    reclaimed = IdempotencyKey.objects.filter(pk=record.pk, created_at=record.created_at).update(
+        created_at=claimed_at,
+        request_method=request.method,
+        request_path=request.path,
+        response_status=None,
+        response_body=None,
+    )
+    if reclaimed:
+        record.created_at = claimed_at
+        record.request_method = request.method
+        record.request_path = request.path
+        record.response_status = record.response_body = None
+        return record
+
+    current = IdempotencyKey.objects.select_for_update().filter(pk=record.pk).first()
+    if current is None:
+        # Purged in the meantime
+        return claim_key(request, record.key)
+    return current
+
+
+def replay(request, record):
+    if (record.request_method, record.request_path) != (request.method, request.path):
+        response = dict(message="Idempotency-Key has already been used for a different request")
+        return Response(response, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+    response = Response(json.loads(record.response_body), status=record.response_status)
+    response['Idempotent-Replayed'] = 'true'
+    return response
@@ -0,0 +1,131 @@
+import logging
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections
+from flight.utils import PerProcess
+
+logger = logging.getLogger(__name__)
+
+CELERY = 'celery'
+THREAD = 'thread'
+
+
+def get_mode():
+    """
+    Dispatch through the broker when a worker consumes it, otherwise through a
+    background thread so eager Celery never runs notification work on the request.
+    """
+    if settings.NOTIFICATION_DISPATCH:
+        return settings.NOTIFICATION_DISPATCH
+    return THREAD if settings.CELERY_ALWAYS_EAGER else CELERY
+
+
+def dispatch(task, *args):
+    """
+    Hand a task off without waiting for it to run.
+    Callers run this after their transaction commits, so a broker error is
+    logged and counted rather than raised; the beat sweeps pick the work up.
+    """
+    mode = get_mode()
+    started = time.perf_counter()
+    if mode == CELERY:
+        try:
+            task.delay(*args)
+        except Exception:
+            logger.exception('Could not enqueue %s', getattr(task, 'name', task))
+            metrics.record_enqueue_failure(mode)
+            return
+    else:
+        background_queue().put(task, args)
+    metrics.record_dispatch(mode, time.perf_counter() - started)
+
+
+class DispatchMetrics(object):
+    """
+    Per-process counters for each dispatch mode.
+    enqueue_ms is time spent on the caller's thread; run_ms is time spent running the task.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.modes = {}
+
+    def mode_stats(self, mode):
+        return self.modes.setdefault(mode, dict(
+            dispatched=0, enqueue_failed=0, completed=0, failed=0,
+            enqueue_ms_total=0.0, enqueue_ms_max=0.0, run_ms_total=0.0,
+        ))
+
+    def record_dispatch(self, mode, seconds):
+        with self.lock:
+            stats = self.mode_stats(mode)
+            stats['dispatched'] += 1
+            stats['enqueue_ms_total'] += seconds * 1000
+            stats['enqueue_ms_max'] = max(stats['enqueue_ms_max'], seconds * 1000)
+
+    def record_enqueue_failure(self, mode):
+        with self.lock:
+            self.mode_stats(mode)['enqueue_failed'] += 1
+
+    def record_run(self, mode, seconds, failed=False):
+        with self.lock:
+            stats = self.mode_stats(mode)
+            stats['failed' if failed else 'completed'] += 1
+            stats['run_ms_total'] += seconds * 1000
+
+    def snapshot(self):
+        with self.lock:
+            modes = {mode: dict(stats) for mode, stats in self.modes.items()}
+        if THREAD in modes:
+            modes[THREAD]['queue_depth'] = background_queue().jobs.qsize()
+        return dict(mode=get_mode(), modes=modes)
+
+
+class BackgroundQueue(object):
+    """
+    A single daemon thread per process that runs dispatched tasks in order.
+    """
+
+    def __init__(self):
+        self.jobs = queue.Queue()
+        self.thread = threading.Thread(target=self.run, name='notification-dispatch', daemon=True)
+        self.thread.start()
+
+    def put(self, task, args):
+        self.jobs.put((task, args))
+
+    def join(self):
+        """
+        Block until every queued task has run.
+        """
+        self.jobs.join()
+
+    def run(self):
+        while True:
+            task, args = self.jobs.get()
+            started = time.perf_counter()
+            failed = False
+            try:
+                task(*args)
+            except Exception:
+                failed = True
+                logger.exception('Background dispatch of %r failed', task)
+            finally:
+                close_old_connections()
+                metrics.record_run(THREAD, time.perf_counter() - started, failed=failed)
+                self.jobs.task_done()
+
+
+metrics = DispatchMetrics()
+_background_queue = PerProcess(BackgroundQueue)
+
+
+def background_queue():
+    return _background_queue.get()
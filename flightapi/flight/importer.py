@@ -0,0 +1,70 @@
+from django.db import DataError, IntegrityError, transaction
+from flight import cache as flight_cache
+from flight.api.serializers import FlightImportSerializer
+from flight.models import Flight
+from rest_framework.exceptions import ValidationError
+
+
+class FlightImporter(object):
+    """
+    Validate flight rows and insert the valid ones with bulk_create, one batch at
+    a time, so memory stays flat however many rows are streamed through.
+
+    Rows are (line, data) pairs. Invalid rows are passed to on_error(line, errors)
+    and skipped; they never abort the rest of the import. A batch the database
+    rejects is retried row by row so only the offending rows are reported.
+    """
+
+    def __init__(self, batch_size, on_error):
+        self.batch_size = batch_size
+        self.on_error = on_error
+        self.serializer = FlightImportSerializer()
+        self.created = 0
+        self.failed = 0
+
+    def run(self, rows):
+        batch = []
+        for line, data in rows:
+            flight = self.build(line, data)
+            if flight is not None:
+                batch.append((line, flight))
+            if len(batch) == self.batch_size:
+                self.insert(batch)
+                batch = []
+        if batch:
+            self.insert(batch)
+        if self.created:
+            flight_cache.invalidate(flight_cache.LIST_SCOPE)
+        return self.created
+
+    def build(self, line, data):
+        try:
+            validated_data = self.serializer.run_validation(data)
+        except ValidationError as error:
+            self.reject(line, error.detail)
+            return None
+        return Flight.for_bulk_insert(**validated_data)
+
+    def insert(self, batch):
+        try:
+            with transaction.atomic():
+                Flight.objects.bulk_create([flight for _, flight in batch])
+        except (DataError, IntegrityError):
+            for line, flight in batch:
+                self.insert_one(line, flight)
+        else:
+            self.created += len(batch)
+
+    def insert_one(self, line, flight):
+        try:
+            with transaction.atomic():
+                Flight.objects.bulk_create([flight])
+        except (DataError, IntegrityError) as error:
+            self.reject(line, dict(non_field_errors=[str(error)]))
+        else:
+            self.created += 1
+
+    def reject(self, line, errors):
+        " Count a row as failed and report it; also for rows that fail before validation "
+        self.failed += 1
+        self.on_error(line, errors)
@@ -0,0 +1,189 @@
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from flight.utils import PerProcess
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'flight-cache:invalidate'
+WORKERS_KEY = 'flight-cache:workers'
+
+
+def worker_id():
+    return '{}:{}'.format(socket.gethostname(), os.getpid())
+
+
+class LocalCache(object):
+    """
+    A bounded per-process LRU of flight payloads in front of the shared cache.
+
+    Entries expire after a TTL and are evicted least recently used first. Each
+    scope has a local generation; invalidating a scope bumps it, which makes every
+    entry stored under the old generation a miss, including one a request was
+    still building when the invalidation arrived.
+    """
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.generations = {}
+        self.epoch = 0
+        self.hits = self.misses = self.evictions = 0
+
+    def generation(self, scope):
+        with self.lock:
+            return self.epoch, self.generations.get(str(scope), 0)
+
+    def get(self, scope, key):
+        entry_key = (str(scope), key)
+        with self.lock:
+            entry = self.entries.get(entry_key)
+            if entry is not None:
+                payload, generation, expires_at = entry
+                if generation == (self.epoch, self.generations.get(entry_key[0], 0)) \
+                        and expires_at > time.monotonic():
+                    self.entries.move_to_end(entry_key)
+                    self.hits += 1
+                    return payload
+                del self.entries[entry_key]
+            self.misses += 1
+            return None
+
+    def set(self, scope, key, payload, generation):
+        entry_key = (str(scope), key)
+        with self.lock:
+            if generation != (self.epoch, self.generations.get(entry_key[0], 0)):
+                return
+            self.entries[entry_key] = (payload, generation, time.monotonic() + self.ttl)
+            self.entries.move_to_end(entry_key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, scope):
+        scope = str(scope)
+        with self.lock:
+            self.generations[scope] = self.generations.get(scope, 0) + 1
+            # One counter per invalidated flight would grow forever; start a new epoch instead.
+            if len(self.generations) > 10 * self.max_entries:
+                self.reset()
+
+    def clear(self):
+        with self.lock:
+            self.reset()
+
+    def reset(self):
+        self.entries.clear()
+        self.generations.clear()
+        self.epoch += 1
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return dict(
+                worker=worker_id(),
+                size=len(self.entries),
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions,
+                hit_ratio=round(self.hits / lookups, 4) if lookups else None,
+                reported_at=time.time(),
+            )
+
+
+class InvalidationSubscriber(threading.Thread):
+    """
+    Apply invalidations published by any worker to this worker's LRU, and publish
+    this worker's stats every FLIGHT_CACHE_STATS_INTERVAL seconds.
+    """
+
+    def __init__(self, local, connection):
+        super(InvalidationSubscriber, self).__init__(name='flight-cache-invalidation', daemon=True)
+        self.local = local
+        self.connection = connection
+
+    def run(self):
+        while True:
+            try:
+                self.listen()
+            except Exception:
+                logger.exception('Flight cache invalidation subscriber lost its connection')
+                time.sleep(1)
+
+    def listen(self):
+        pubsub = self.connection.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(CHANNEL)
+        # Anything published while we were not subscribed was missed.
+        self.local.clear()
+        next_report = 0
+        while True:
+            message = pubsub.get_message(timeout=1.0)
+            if message is not None:
+                self.local.invalidate(message['data'].decode())
+            if time.monotonic() >= next_report:
+                stats = self.local.stats()
+                self.connection.hset(WORKERS_KEY, stats['worker'], json.dumps(stats))
+                next_report = time.monotonic() + settings.FLIGHT_CACHE_STATS_INTERVAL
+
+
+def redis_connection():
+    " The raw Redis client behind the default cache, or None when it is not Redis "
+    try:
+        from django_redis import get_redis_connection
+        return get_redis_connection('default')
+    except (ImportError, NotImplementedError):
+        return None
+
+
+def start_local_cache():
+    """
+    This process's LRU, plus the subscriber thread that applies invalidations
+    published by other workers to it.
+    """
+    local = LocalCache(settings.FLIGHT_LOCAL_CACHE_SIZE, settings.FLIGHT_LOCAL_CACHE_TTL)
+    connection = redis_connection()
+    if connection is not None:
+        InvalidationSubscriber(local, connection).start()
+    return local
+
+
+_local_cache = PerProcess(start_local_cache)
+
+
+def local_cache():
+    return _local_cache.get()
+
+
+def publish_invalidation(scope):
+    local_cache().invalidate(scope)
+    connection = redis_connection()
+    if connection is not None:
+        connection.publish(CHANNEL, str(scope))
+
+
+def worker_stats():
+    """
+    The latest stats every live worker has published, or just this worker's
+    when the cache is not Redis.
+    """
+    connection = redis_connection()
+    if connection is None:
+        return [local_cache().stats()]
+
+    stale_before = time.time() - 3 * settings.FLIGHT_CACHE_STATS_INTERVAL
+    workers = []
+    for worker, stats in connection.hgetall(WORKERS_KEY).items():
+        stats = json.loads(stats.decode())
+        if stats['reported_at'] < stale_before:
+            connection.hdel(WORKERS_KEY, worker)
+        else:
+            workers.append(stats)
+    return sorted(workers, key=lambda stats: stats['worker'])
@@ -0,0 +1,66 @@
+import time
+from datetime import date, time as clock
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from flight.api.serializers import FlightSerializer, TicketSerializer, values_serializer
+from flight.models import Flight, Ticket
+from portfolio.models import User
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Compare ModelSerializer and values() fast path serialization on large lists'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000,
+                            help='Number of flights and tickets to serialize')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.seed(options['rows'])
+                for serializer_class, queryset in (
+                    (FlightSerializer, Flight.objects.order_by('id')),
+                    (TicketSerializer, Ticket.objects.select_related('flight').order_by('id')),
+                ):
+                    self.compare(serializer_class, queryset)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def seed(self, rows):
+        user = User.objects.create(email='benchmark@fastpace.com')
+        flights = Flight.objects.bulk_create([
+            Flight(
+                flight_number='BM{}'.format(number), departure_location='lagos', arrival_location='abuja',
+                departure_date=date(2019, 1, 1), departure_time=clock(10, 30),
+                arrival_date=date(2019, 1, 1), arrival_time=clock(11, 45), capacity=150,
+            ) for number in range(rows)
+        ], batch_size=500)
+        flights = Flight.objects.filter(flight_number__startswith='BM')
+        Ticket.objects.bulk_create([
+            Ticket(
+                flight=flight, user=user, departure_location=flight.departure_location,
+                arrival_location=flight.arrival_location, departure_date=flight.departure_date,
+                departure_time=flight.departure_time, arrival_date=flight.arrival_date,
+                arrival_time=flight.arrival_time,
+            ) for flight in flights
+        ], batch_size=500)
+
+    def compare(self, serializer_class, queryset):
+        started = time.perf_counter()
+        serializer_class(queryset, many=True).data
+        model_seconds = time.perf_counter() - started
+
+        reader = values_serializer(serializer_class)
+        started = time.perf_counter()
+        reader.many(reader.values(queryset))
+        values_seconds = time.perf_counter() - started
+
+        self.stdout.write('{}: ModelSerializer {:.3f}s, values fast path {:.3f}s ({:.1f}x)'.format(
+            serializer_class.__name__, model_seconds, values_seconds, model_seconds / values_seconds
+        ))
@@ -0,0 +1,28 @@
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+from flight.models import FlightSchedule
+
+
+class Command(BaseCommand):
+    help = 'Create the missing flights of every recurring schedule for the coming days'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.FLIGHT_SCHEDULE_HORIZON_DAYS,
+                            help='How many days ahead of the start date to fill in')
+        parser.add_argument('--start', help='First departure date, YYYY-MM-DD; defaults to today')
+
+    def handle(self, *args, **options):
+        start = date.today()
+        if options['start']:
+            start = parse_date(options['start'])
+            if start is None:
+                raise CommandError('--start must be in the format YYYY-MM-DD')
+        end = start + timedelta(days=options['days'])
+
+        created = FlightSchedule.objects.generate(start, end)
+        self.stdout.write(self.style.SUCCESS(
+            'Created {} scheduled flights from {} to {}'.format(created, start, end)
+        ))
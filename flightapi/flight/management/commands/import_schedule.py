@@ -0,0 +1,53 @@
+import csv
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from flight.importer import FlightImporter
+
+
+class Command(BaseCommand):
+    help = 'Stream a CSV or JSONL flight schedule into the flight table in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV file with a header row, or JSONL file with one flight per line')
+        parser.add_argument('--format', choices=('csv', 'jsonl'),
+                            help='File format; defaults to the file extension')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Number of flights validated and inserted per query')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or os.path.splitext(path)[1].lstrip('.').lower()
+        if file_format not in ('csv', 'jsonl'):
+            raise CommandError('Cannot tell the format of {}; pass --format csv or --format jsonl'.format(path))
+
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+
+        importer = FlightImporter(options['batch_size'], self.report_error)
+        with open(path, newline='') as schedule:
+            rows = self.csv_rows(schedule) if file_format == 'csv' else self.jsonl_rows(schedule, importer)
+            created = importer.run(rows)
+
+        self.stdout.write(self.style.SUCCESS(
+            'Imported {} flights, skipped {} invalid rows'.format(created, importer.failed)
+        ))
+
+    def csv_rows(self, schedule):
+        reader = csv.DictReader(schedule)
+        for row in reader:
+            # Empty cells mean "not given" rather than an empty value
+            yield reader.line_num, {field: value for field, value in row.items() if value != ''}
+
+    def jsonl_rows(self, schedule, importer):
+        for line, text in enumerate(schedule, start=1):
+            if not text.strip():
+                continue
+            try:
+                yield line, json.loads(text)
+            except ValueError as error:
+                importer.reject(line, 'Invalid JSON: {}'.format(error))
+
+    def report_error(self, line, errors):
+        self.stderr.write('line {}: {}'.format(line, json.dumps(errors)))
@@ -0,0 +1,142 @@
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.db import IntegrityError, models, transaction
+from django.db.models import Case, Count, F, IntegerField, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Coalesce, Greatest
+from flight import cache as flight_cache
+
+
+class FlightManager(models.Manager):
+
+    def take_seat(self, flight_id):
+        """
+        Take one seat on a flight with a single conditional UPDATE.
+        Flights without a capacity are never sold out.
+        Returns False when the flight has no seat left.
+        """
+        updated = self.filter(pk=flight_id).filter(
+            Q(seats_remaining__isnull=True) | Q(seats_remaining__gt=0)
+        ).update(seats_remaining=F('seats_remaining') - 1, updated_at=datetime.now(tz=timezone.utc))
+        if updated:
+            # Queryset updates send no post_save, so drop the cached seat count here.
+            # Only the flight's own payload: a sale must not empty every cached list page.
+            flight_cache.invalidate(flight_id)
+        return updated == 1
+
+    def release_seat(self, flight_id):
+        """
+        Give a seat back to a flight, never beyond its capacity.
+        """
+        if self.filter(
+            pk=flight_id, seats_remaining__lt=F('capacity')
+        ).update(seats_remaining=F('seats_remaining') + 1, updated_at=datetime.now(tz=timezone.utc)):
+            flight_cache.invalidate(flight_id)
+
+
+    def set_capacity(self, flight_id, capacity):
+        """
+        Change a flight's capacity and move its seats_remaining by the same amount
+        in one conditional UPDATE, never below zero. A flight that had no capacity
+        starts from the new capacity minus its tickets; clearing the capacity makes
+        it unlimited again.
+        """
+        if capacity is None:
+            seats_remaining = Value(None, output_field=IntegerField())
+        else:
+            tickets = self.model._meta.get_field('tickets').related_model.objects.filter(
+                flight=OuterRef('pk')
+            ).order_by().values('flight').annotate(count=Count('pk')).values('count')
+            seats_remaining = Case(
+                When(seats_remaining__isnull=True, then=Greatest(
+                    Value(capacity) - Coalesce(Subquery(tickets, output_field=IntegerField()), 0), 0
+                )),
+                default=Greatest(F('seats_remaining') + capacity - F('capacity'), 0),
+                output_field=IntegerField(),
+            )
+        # SET reads the old row, so the delta is taken against the previous capacity.
+        self.filter(pk=flight_id).update(
+            capacity=capacity, seats_remaining=seats_remaining, updated_at=datetime.now(tz=timezone.utc)
+        )
+        flight_cache.invalidate_flight(flight_id)
+
+
+class FlightScheduleManager(models.Manager):
+
+    def generate(self, start, end, schedules=None):
+        """
+        Create the Flight rows that schedules (default: all) are missing between
+        start and end inclusive, and return how many were created.
+
+        Dates that already have a flight are skipped, so running it again is a
+        no-op and extending end only inserts the new days. Each schedule is locked
+        while its days are filled in, so concurrent runs never insert a day twice.
+        """
+        if schedules is None:
+            schedules = self.all()
+        schedule_ids = schedules.filter(
+            Q(valid_until__isnull=True) | Q(valid_until__gte=start), valid_from__lte=end
+        ).values_list('id', flat=True)
+
+        created = 0
+        for schedule_id in schedule_ids.iterator():
+            with transaction.atomic():
+                schedule = self.select_for_update().filter(pk=schedule_id).first()
+                if schedule is None:
+                    continue
+                existing = set(schedule.flights.filter(
+                    departure_date__gte=start, departure_date__lte=end
+                ).values_list('departure_date', flat=True))
+                flights = [schedule.build_flight(day) for day in schedule.departure_dates(start, end)
+                           if day not in existing]
+                schedule.flights.model.objects.bulk_create(flights, batch_size=settings.FLIGHT_SCHEDULE_BATCH_SIZE)
+                created += len(flights)
+        if created:
+            flight_cache.invalidate(flight_cache.LIST_SCOPE)
+        return created
+
+
+class ReservationCounterManager(models.Manager):
+
+    def adjust(self, key, delta):
+        """
+        Add delta to the (flight, date, status) counter named by key.
+        """
+        if key is None:
+            return
+        flight_id, date, status = key
+        counters = self.filter(flight_id=flight_id, date=date, status=status)
+        if delta < 0:
+            counters.filter(count__gte=-delta).update(count=F('count') + delta)
+            return
+        if counters.update(count=F('count') + delta):
+            return
+        try:
+            with transaction.atomic():
+                self.create(flight_id=flight_id, date=date, status=status, count=delta)
+        except IntegrityError:
+            counters.update(count=F('count') + delta)
+
+
+class TicketEventManager(models.Manager):
+
+    def record(self, ticket_id, event):
+        """
+        Write an outbox row once per (ticket, event) and publish it after the transaction commits.
+        """
+        try:
+            with transaction.atomic():
+                self.create(ticket_id=ticket_id, event=event)
+        except IntegrityError:
+            return
+        from flight.dispatch import dispatch
+        from flight.tasks import publish_ticket_events
+        transaction.on_commit(lambda: dispatch(publish_ticket_events))
+
+    def mark_notified(self, event_id):
+        """
+        Mark an event's notification as handled with one conditional UPDATE.
+        Returns False when it already was, or the event has been purged.
+        """
+        return self.filter(pk=event_id, notified_at__isnull=True).update(
+            notified_at=datetime.now(tz=timezone.utc)) == 1
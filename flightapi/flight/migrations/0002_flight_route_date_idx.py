@@ -0,0 +1,17 @@
+# Generated by Django 2.1.3 on 2026-10-18 10:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flight', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='flight',
+            index=models.Index(fields=['departure_location', 'arrival_location', 'departure_date'], name='flight_route_date_idx'),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 2.1.3 on 2026-10-18 10:40
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Case, Count, F, IntegerField, When
+from django.db.models.functions import Least
+
+STATUS_RANK = Case(
+    When(status='CONFIRMED', then=2),
+    When(status='BOOKED', then=1),
+    default=0,
+    output_field=IntegerField(),
+)
+
+
+def remove_duplicate_tickets(apps, schema_editor):
+    """
+    A user may hold several tickets on one flight from before reservations were
+    unique. Keep the most advanced (then newest) one and drop the rest, giving
+    any counted seat back to the flight.
+    """
+    Flight = apps.get_model('flight', 'Flight')
+    Ticket = apps.get_model('flight', 'Ticket')
+    duplicated = Ticket.objects.filter(flight__isnull=False).values(
+        'user_id', 'flight_id').annotate(tickets=Count('id')).filter(tickets__gt=1)
+    for row in duplicated:
+        ticket_ids = Ticket.objects.filter(
+            user_id=row['user_id'], flight_id=row['flight_id']
+        ).annotate(rank=STATUS_RANK).order_by(
+            '-rank', F('created_at').desc(nulls_last=True), '-id').values_list('id', flat=True)
+        extra_ids = list(ticket_ids)[1:]
+        Ticket.objects.filter(pk__in=extra_ids).delete()
+        Flight.objects.filter(pk=row['flight_id'], seats_remaining__isnull=False).update(
+            seats_remaining=Least(F('seats_remaining') + len(extra_ids), F('capacity')))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('flight', '0002_flight_route_date_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='flight',
+            name='capacity',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='flight',
+            name='seats_remaining',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(remove_duplicate_tickets, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='ticket',
+            unique_together={('user', 'flight')},
+        ),
+    ]
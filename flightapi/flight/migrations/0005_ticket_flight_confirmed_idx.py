@@ -0,0 +1,17 @@
+# Generated by Django 2.1.3 on 2026-10-18 10:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flight', '0004_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(fields=['flight', 'status', 'confirmed_from'], name='ticket_flight_confirmed_idx'),
+        ),
+    ]
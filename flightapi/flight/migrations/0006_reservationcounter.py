@@ -0,0 +1,54 @@
+# Generated by Django 2.1.3 on 2026-10-18 10:45
+
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+import django.db.models.deletion
+
+
+def backfill_counters(apps, schema_editor):
+    """
+    Count existing tickets into the new counters, as rebuild_reservation_counters
+    does: confirmed tickets on the day they were confirmed, others on the day
+    they were created.
+    """
+    Ticket = apps.get_model('flight', 'Ticket')
+    ReservationCounter = apps.get_model('flight', 'ReservationCounter')
+    confirmed = Ticket.objects.filter(
+        status='CONFIRMED', confirmed_from__isnull=False
+    ).annotate(date=TruncDate('confirmed_from'))
+    pending = Ticket.objects.filter(
+        status__in=('RESERVED', 'BOOKED'), created_at__isnull=False
+    ).annotate(date=TruncDate('created_at'))
+    for tickets in (confirmed, pending):
+        rows = tickets.filter(flight__isnull=False).values(
+            'flight_id', 'date', 'status'
+        ).annotate(count=Count('id')).order_by()
+        ReservationCounter.objects.bulk_create(
+            [ReservationCounter(**row) for row in rows.iterator()], batch_size=1000
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flight', '0005_ticket_flight_confirmed_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReservationCounter',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('status', models.CharField(choices=[('RESERVED', 'Reserved'), ('BOOKED', 'Booked'), ('CONFIRMED', 'Confirmed')], max_length=50)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('flight', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservation_counters', to='flight.Flight')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='reservationcounter',
+            unique_together={('flight', 'date', 'status')},
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 2.1.3 on 2026-10-18 10:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flight', '0006_reservationcounter'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(fields=['status', 'departure_date'], name='ticket_status_departure_idx'),
+        ),
+    ]
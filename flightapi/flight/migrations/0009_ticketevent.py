@@ -0,0 +1,28 @@
+# Generated by Django 2.1.3 on 2026-10-18 10:49
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flight', '0008_queuedemail'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TicketEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event', models.CharField(choices=[('RESERVED', 'Reserved'), ('BOOKED', 'Booked'), ('CONFIRMED', 'Confirmed')], max_length=50)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('published_at', models.DateTimeField(blank=True, db_index=True, null=True)),
+                ('ticket', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='events', to='flight.Ticket')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='ticketevent',
+            unique_together={('ticket', 'event')},
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 2.1.3 on 2026-10-18 11:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flight', '0009_ticketevent'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(fields=['user', 'status', 'departure_date'], name='ticket_user_status_dep_idx'),
+        ),
+    ]
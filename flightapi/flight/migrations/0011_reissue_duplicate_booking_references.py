@@ -0,0 +1,31 @@
+# Generated by Django 2.1.3 on 2026-10-18 11:15
+
+from django.db import migrations
+from django.db.models import Count
+from flight.utils import booking_reference
+
+
+def reissue_duplicate_references(apps, schema_editor):
+    """
+    Legacy six character references were random and may collide. The oldest ticket
+    keeps each duplicated reference; the rest get a new (eight character) one.
+    """
+    Ticket = apps.get_model('flight', 'Ticket')
+    duplicated = Ticket.objects.filter(booking_reference__isnull=False).values(
+        'booking_reference').annotate(tickets=Count('id')).filter(tickets__gt=1)
+    for row in duplicated:
+        ticket_ids = Ticket.objects.filter(
+            booking_reference=row['booking_reference']).order_by('id').values_list('id', flat=True)
+        for ticket_id in list(ticket_ids)[1:]:
+            Ticket.objects.filter(pk=ticket_id).update(booking_reference=booking_reference(ticket_id))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flight', '0010_ticket_user_status_dep_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(reissue_duplicate_references, migrations.RunPython.noop),
+    ]
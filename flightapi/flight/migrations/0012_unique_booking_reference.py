@@ -0,0 +1,18 @@
+# Generated by Django 2.1.3 on 2026-10-18 11:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flight', '0011_reissue_duplicate_booking_references'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='ticket',
+            name='booking_reference',
+            field=models.CharField(blank=True, max_length=255, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.1.3 on 2026-10-18 11:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flight', '0014_flightschedule'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ticketevent',
+            name='notified_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -1,10 +1,13 @@
-import uuid
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 
 from django.conf import settings
-from django.db import models
+from django.core.mail import EmailMessage
+from django.core.validators import RegexValidator
+from django.db import models, transaction
 from djmoney.models.fields import MoneyField
+from flight.manager import FlightManager, FlightScheduleManager, ReservationCounterManager, TicketEventManager
 from flight.mixins import FlightMixin
+from flight.utils import booking_reference
 
 
 class Flight(FlightMixin):
@@ -37,6 +40,120 @@ class Flight(FlightMixin):
     status = models.CharField(max_length=50, choices=STATUS, default=AVAILABLE)
     price = MoneyField(max_digits=14, decimal_places=2, default_currency='NGN')
     created_at = models.DateTimeField(auto_now_add=True, null=True)
+    capacity = models.PositiveIntegerField(blank=True, null=True)
+    seats_remaining = models.PositiveIntegerField(blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+    schedule = models.ForeignKey('flight.FlightSchedule', on_delete=models.SET_NULL, related_name="flights",
+                                 blank=True, null=True)
+
+    objects = FlightManager()
+
+    class Meta:
+        # One flight per schedule and day; flights entered by hand have no schedule.
+        unique_together = ('schedule', 'departure_date')
+        indexes = [
+            models.Index(
+                fields=['departure_location', 'arrival_location', 'departure_date'],
+                name='flight_route_date_idx'
+            ),
+        ]
+
+    # Seat counts only ever change through FlightManager's conditional UPDATEs.
+    SEAT_FIELDS = ('capacity', 'seats_remaining')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        flight = super(Flight, cls).from_db(db, field_names, values)
+        if 'capacity' in flight.__dict__:
+            flight._loaded_capacity = flight.capacity
+        return flight
+
+    @classmethod
+    def for_bulk_insert(cls, **fields):
+        """
+        A new flight ready for bulk_create, which skips save() and so would
+        otherwise leave seats_remaining unset.
+        """
+        flight = cls(**fields)
+        flight.fill_seats_remaining()
+        return flight
+
+    def fill_seats_remaining(self):
+        " A new flight starts with every seat free "
+        if self.seats_remaining is None:
+            self.seats_remaining = self.capacity
+
+    def save(self, *args, **kwargs):
+        if self._state.adding or kwargs.get('force_insert') or 'update_fields' in kwargs:
+            if self.pk is None:
+                self.fill_seats_remaining()
+            super(Flight, self).save(*args, **kwargs)
+            return
+
+        # Writing back the loaded seat count would undo seats sold since it was read.
+        kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                   if not field.primary_key and field.name not in self.SEAT_FIELDS
+                                   and field.attname in self.__dict__]
+        with transaction.atomic():
+            super(Flight, self).save(*args, **kwargs)
+            if 'capacity' in self.__dict__ and self.capacity != getattr(self, '_loaded_capacity', object()):
+                Flight.objects.set_capacity(self.pk, self.capacity)
+                self.seats_remaining = Flight.objects.filter(pk=self.pk).values_list(
+                    'seats_remaining', flat=True).get()
+                self._loaded_capacity = self.capacity
+
+
+class FlightSchedule(models.Model):
+    """
+    A recurring service that generates one Flight per operating day.
+    Days of the week are ISO weekday digits, e.g. "12345" for Monday to Friday.
+    """
+    flight_number = models.CharField(max_length=255)
+    departure_location = models.CharField(max_length=255)
+    arrival_location = models.CharField(max_length=255)
+    departure_time = models.TimeField()
+    arrival_time = models.TimeField()
+    # Days between departure and arrival, 1 for an overnight flight
+    arrival_day_offset = models.PositiveSmallIntegerField(default=0)
+    days_of_week = models.CharField(max_length=7, validators=[
+        RegexValidator(r'^(?!.*(.).*\1)[1-7]{1,7}$', 'Use each ISO weekday digit 1-7 at most once')
+    ])
+    valid_from = models.DateField()
+    valid_until = models.DateField(blank=True, null=True)
+    price = MoneyField(max_digits=14, decimal_places=2, default_currency='NGN')
+    capacity = models.PositiveIntegerField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = FlightScheduleManager()
+
+    def departure_dates(self, start, end):
+        """
+        The operating days between start and end inclusive, clipped to the validity range.
+        """
+        start = max(start, self.valid_from)
+        if self.valid_until is not None:
+            end = min(end, self.valid_until)
+        weekdays = {int(day) for day in self.days_of_week}
+        day = start
+        while day <= end:
+            if day.isoweekday() in weekdays:
+                yield day
+            day += timedelta(days=1)
+
+    def build_flight(self, departure_date):
+        return Flight.for_bulk_insert(
+            schedule=self,
+            flight_number=self.flight_number,
+            departure_location=self.departure_location,
+            arrival_location=self.arrival_location,
+            departure_date=departure_date,
+            departure_time=self.departure_time,
+            arrival_date=departure_date + timedelta(days=self.arrival_day_offset),
+            arrival_time=self.arrival_time,
+            price=self.price,
+            capacity=self.capacity,
+        )
 
 
 class Ticket(FlightMixin):
@@ -49,18 +166,141 @@ class Ticket(FlightMixin):
         (BOOKED, 'Booked'),
         (CONFIRMED, 'Confirmed'),
     )
-    booking_reference = models.CharField(max_length=255, blank=True, null=True)
+    booking_reference = models.CharField(max_length=255, blank=True, null=True, unique=True)
     flight = models.ForeignKey('flight.Flight', on_delete=models.CASCADE, related_name="tickets", null=True)
     status = models.CharField(max_length=50, choices=STATUS, default=RESERVED)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True, null=True)
     confirmed_from = models.DateTimeField(blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('user', 'flight')
+        indexes = [
+            models.Index(
+                fields=['flight', 'status', 'confirmed_from'],
+                name='ticket_flight_confirmed_idx'
+            ),
+            models.Index(
+                fields=['status', 'departure_date'],
+                name='ticket_status_departure_idx'
+            ),
+            models.Index(
+                fields=['user', 'status', 'departure_date'],
+                name='ticket_user_status_dep_idx'
+            ),
+        ]
+
+    COUNTER_FIELDS = ('flight_id', 'status', 'created_at', 'confirmed_from')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        ticket = super(Ticket, cls).from_db(db, field_names, values)
+        if all(field in ticket.__dict__ for field in cls.COUNTER_FIELDS):
+            ticket._loaded_counter_key = ticket.counter_key()
+        return ticket
 
     def save(self, *args, **kwargs):
-        if self.status == Ticket.CONFIRMED:
-            self.booking_reference = self.reference_id_generator()
+        # Reference and confirmation time are fixed the first time a ticket is confirmed.
+        needs_reference = self.status == Ticket.CONFIRMED and not self.booking_reference
+        if needs_reference:
             self.confirmed_from = datetime.now(tz=timezone.utc)
-        super(Ticket, self).save(*args, **kwargs)
+            if self.pk is not None:
+                self.booking_reference = booking_reference(self.pk)
+
+        with transaction.atomic():
+            if self.pk is None:
+                previous_key = None
+            elif hasattr(self, '_loaded_counter_key'):
+                previous_key = self._loaded_counter_key
+            else:
+                previous_key = Ticket.objects.filter(pk=self.pk).only(
+                    *self.COUNTER_FIELDS).first()
+                previous_key = previous_key.counter_key() if previous_key else None
+            super(Ticket, self).save(*args, **kwargs)
+            if needs_reference and not self.booking_reference:
+                self.booking_reference = booking_reference(self.pk)
+                Ticket.objects.filter(pk=self.pk).update(
+                    booking_reference=self.booking_reference, updated_at=self.updated_at)
+            current_key = self.counter_key()
+            if previous_key != current_key:
+                ReservationCounter.objects.adjust(previous_key, -1)
+                ReservationCounter.objects.adjust(current_key, 1)
+            previous_status = previous_key[2] if previous_key else None
+            if self.status != previous_status and self.status in TicketEvent.EVENTS:
+                TicketEvent.objects.record(self.pk, self.status)
+        self._loaded_counter_key = current_key
+
+    def counter_key(self):
+        """
+        The (flight, date, status) reservation counter this ticket is counted in.
+        Confirmed tickets count on the day they were confirmed, others on the day they were created.
+        """
+        counted_from = self.confirmed_from if self.status == Ticket.CONFIRMED else self.created_at
+        if self.flight_id is None or counted_from is None:
+            return None
+        return (self.flight_id, counted_from.astimezone(timezone.utc).date(), self.status)
+
+
+class ReservationCounter(models.Model):
+    flight = models.ForeignKey('flight.Flight', on_delete=models.CASCADE, related_name="reservation_counters")
+    date = models.DateField()
+    status = models.CharField(max_length=50, choices=Ticket.STATUS)
+    count = models.PositiveIntegerField(default=0)
+
+    objects = ReservationCounterManager()
+
+    class Meta:
+        unique_together = ('flight', 'date', 'status')
+
+
+
+class TicketEvent(models.Model):
+    """
+    Outbox row for a ticket notification, written in the same transaction as the ticket change.
+    """
+    EVENTS = (
+        Ticket.RESERVED,
+        Ticket.CONFIRMED,
+    )
+
+    ticket = models.ForeignKey('flight.Ticket', on_delete=models.CASCADE, related_name="events")
+    event = models.CharField(max_length=50, choices=Ticket.STATUS)
+    created_at = models.DateTimeField(auto_now_add=True)
+    published_at = models.DateTimeField(blank=True, null=True, db_index=True)
+    notified_at = models.DateTimeField(blank=True, null=True)
+
+    objects = TicketEventManager()
+
+    class Meta:
+        unique_together = ('ticket', 'event')
+
+class IdempotencyKey(models.Model):
+    key = models.CharField(max_length=255)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    request_method = models.CharField(max_length=10)
+    request_path = models.CharField(max_length=255)
+    response_status = models.PositiveSmallIntegerField(blank=True, null=True)
+    response_body = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        unique_together = ('user', 'key')
+
+    @property
+    def is_expired(self):
+        return self.created_at <= datetime.now(tz=timezone.utc) - settings.IDEMPOTENCY_KEY_TTL
+
+
+class QueuedEmail(models.Model):
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=255, blank=True, null=True)
+    to_email = models.CharField(max_length=255)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    claimed_at = models.DateTimeField(blank=True, null=True)
 
-    def reference_id_generator(self):
-        return uuid.uuid4().hex.upper()[0:6]
+    def as_message(self, connection):
+        return EmailMessage(self.subject, self.body, self.from_email, [self.to_email], connection=connection)
@@ -7,7 +7,7 @@ class IsOwner(permissions.BasePermission):
     """
 
     def has_object_permission(self, request, view, obj):
-        if obj.user == request.user:
+        if obj.user_id == request.user.pk:
             return True
         else:
             return False
\ No newline at end of file
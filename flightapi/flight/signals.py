@@ -0,0 +1,21 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from flight import cache as flight_cache
+from flight.models import Flight, ReservationCounter, Ticket
+
+
+@receiver(post_delete, sender=Ticket)
+def release_reservation_count(sender, instance, **kwargs):
+    ReservationCounter.objects.adjust(instance.counter_key(), -1)
+
+
+@receiver(post_save, sender=Flight)
+@receiver(post_delete, sender=Flight)
+def invalidate_cached_flight(sender, instance, **kwargs):
+    flight_cache.invalidate_flight(instance.pk)
+
+
+@receiver(post_save, sender=Ticket)
+@receiver(post_delete, sender=Ticket)
+def invalidate_ticket_list(sender, instance, **kwargs):
+    flight_cache.invalidate(flight_cache.TICKET_LIST_SCOPE)
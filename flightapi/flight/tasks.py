@@ -1,18 +1,23 @@
 from __future__ import absolute_import, unicode_literals
 
-from datetime import date, datetime
+import logging
+import smtplib
+from datetime import date, datetime, timedelta, timezone
 
-from portfolio.models import User
 from celery import shared_task
 from flightapi.celeryapp import app
 from django.conf import settings
-from django.core.mail import send_mail
+from django.core.mail import get_connection
+from django.db import transaction
+from django.db.models import Q
 from django.template.loader import get_template
-from flight.models import Ticket
+from flight.models import FlightSchedule, IdempotencyKey, QueuedEmail, Ticket, TicketEvent
+
+logger = logging.getLogger(__name__)
 
 
 @shared_task()
-def notify_user_on_confirmed_ticket(ticket_id):
+def notify_user_on_confirmed_ticket(ticket_id, event_id=None):
     try:
         confirmed_ticket = Ticket.objects.get(pk=ticket_id)
     except Ticket.DoesNotExist:
@@ -33,11 +38,11 @@ def notify_user_on_confirmed_ticket(ticket_id):
     from_email = settings.FASTPACE_EMAIL
     to_email = confirmed_ticket.user.email
     ticket_info = get_template('acknowledgement.txt').render(context)
-    send_mail(title, ticket_info, from_email, [to_email], fail_silently=True)
+    queue_event_email(event_id, subject=title, body=ticket_info, from_email=from_email, to_email=to_email)
 
 
 @shared_task()
-def notify_user_on_reservation(ticket_id):
+def notify_user_on_reservation(ticket_id, event_id=None):
     try:
         reserved_ticket = Ticket.objects.get(pk=ticket_id)
     except Ticket.DoesNotExist: 
@@ -57,47 +62,204 @@ def notify_user_on_reservation(ticket_id):
     from_email = settings.FASTPACE_EMAIL
     to_email = reserved_ticket.user.email
     reservation_info = get_template('reserved.txt').render(context)
-    send_mail(title, reservation_info, from_email, [to_email], fail_silently=True)
+    queue_event_email(event_id, subject=title, body=reservation_info, from_email=from_email, to_email=to_email)
+
+
+def queue_event_email(event_id, **email):
+    """
+    Queue a notification email once per outbox event. The relay delivers events
+    at least once, so a redelivered event finds it already handled and queues
+    nothing; the email and the handled mark commit together.
+    """
+    with transaction.atomic():
+        if event_id is not None and not TicketEvent.objects.mark_notified(event_id):
+            return
+        QueuedEmail.objects.create(**email)
+    send_queued_mail.delay()
 
 
 @app.task
 def send_reminder_to_travellers():
-    now = datetime.now()
-    current_year = int(now.strftime("%Y"))
-    current_month = int(now.strftime("%m"))
-    current_day = int(now.strftime("%d"))
-    current_date = date(current_year, current_month, current_day)
-
-    customers = User.objects.all()
-
-    for customer in customers:
-        tickets = Ticket.objects.filter(user=customer, status=Ticket.CONFIRMED)
-
-        if tickets.exists():
-            confirmed_ticket = tickets[0]
-            departure_date = confirmed_ticket.departure_date
-            departure_year = int(departure_date.strftime("%Y"))
-            departure_month = int(departure_date.strftime("%m"))
-            departure_day = int(departure_date.strftime("%d"))
-            confirmed_departure_date = date(departure_year, departure_month, departure_day)
-
-            delta = confirmed_departure_date - current_date
-            number_of_days = delta.days
-
-            if number_of_days <= 1:
-                title = "Reminder Event for Flight {0}".format(confirmed_ticket.flight.flight_number)
-                context = dict(
-                    name=confirmed_ticket.user.first_name,
-                    flight_number=confirmed_ticket.flight.flight_number,
-                    arrival_time=confirmed_ticket.arrival_time,
-                    arrival_date=confirmed_ticket.arrival_date,
-                    departure_time=confirmed_ticket.departure_time,
-                    departure_date=confirmed_ticket.departure_date,
-                    departure_location=confirmed_ticket.departure_location,
-                    arrival_location=confirmed_ticket.arrival_location,
-                    ticket_reference=confirmed_ticket.booking_reference
-                )
-                from_email = settings.FASTPACE_EMAIL
-                to_email = confirmed_ticket.user.email
-                reservation_info = get_template('reminder.txt').render(context)
-                send_mail(title, reservation_info, from_email, [to_email], fail_silently=True)
+    """
+    Fan confirmed tickets departing today or tomorrow out to reminder subtasks
+    in fixed-size chunks, streaming ids so memory stays flat.
+    """
+    today = date.today()
+    ticket_ids = Ticket.objects.filter(
+        status=Ticket.CONFIRMED,
+        departure_date__gte=today,
+        departure_date__lte=today + timedelta(days=1),
+    ).order_by().values_list('pk', flat=True)
+
+    chunk = []
+    for ticket_id in ticket_ids.iterator():
+        chunk.append(ticket_id)
+        if len(chunk) == settings.REMINDER_CHUNK_SIZE:
+            send_reminders_for_tickets.delay(chunk)
+            chunk = []
+    if chunk:
+        send_reminders_for_tickets.delay(chunk)
+
+
+@app.task
+def send_reminders_for_tickets(ticket_ids):
+    tickets = Ticket.objects.filter(pk__in=ticket_ids).select_related('user', 'flight')
+    from_email = settings.FASTPACE_EMAIL
+    template = get_template('reminder.txt')
+
+    emails = []
+    for confirmed_ticket in tickets:
+        title = "Reminder Event for Flight {0}".format(confirmed_ticket.flight.flight_number)
+        context = dict(
+            name=confirmed_ticket.user.first_name,
+            flight_number=confirmed_ticket.flight.flight_number,
+            arrival_time=confirmed_ticket.arrival_time,
+            arrival_date=confirmed_ticket.arrival_date,
+            departure_time=confirmed_ticket.departure_time,
+            departure_date=confirmed_ticket.departure_date,
+            departure_location=confirmed_ticket.departure_location,
+            arrival_location=confirmed_ticket.arrival_location,
+            ticket_reference=confirmed_ticket.booking_reference
+        )
+        to_email = confirmed_ticket.user.email
+        reminder_info = template.render(context)
+        emails.append(QueuedEmail(subject=title, body=reminder_info, from_email=from_email, to_email=to_email))
+    QueuedEmail.objects.bulk_create(emails)
+    send_queued_mail.delay()
+
+
+@app.task
+def send_queued_mail():
+    """
+    Drain the mail queue in batches, sending each batch over one SMTP connection.
+    A batch is claimed with SKIP LOCKED and marked claimed in a short transaction
+    that commits before anything is sent, so no lock or transaction is held over
+    SMTP and several workers can drain in parallel. A failed message stays queued
+    for the next run until it runs out of attempts; a claim left by a worker that
+    died is taken over after MAIL_CLAIM_TIMEOUT.
+    """
+    last_id = 0
+    while True:
+        now = datetime.now(tz=timezone.utc)
+        with transaction.atomic():
+            batch = list(
+                QueuedEmail.objects.filter(
+                    Q(claimed_at__isnull=True) | Q(claimed_at__lte=now - settings.MAIL_CLAIM_TIMEOUT),
+                    attempts__lt=settings.MAIL_MAX_ATTEMPTS,
+                    id__gt=last_id,
+                ).order_by('id').select_for_update(skip_locked=True)[:settings.MAIL_BATCH_SIZE]
+            )
+            if not batch:
+                return
+            QueuedEmail.objects.filter(id__in=[email.id for email in batch]).update(claimed_at=now)
+        last_id = batch[-1].id
+
+        sent, failed = [], []
+        with get_connection() as connection:
+            for email in batch:
+                try:
+                    connection.send_messages([email.as_message(connection)])
+                except Exception as error:
+                    email.attempts += 1
+                    email.last_error = str(error)
+                    email.claimed_at = None
+                    failed.append(email)
+                    if is_connection_error(error):
+                        reopen(connection)
+                else:
+                    sent.append(email.id)
+
+        QueuedEmail.objects.filter(id__in=sent).delete()
+        for email in failed:
+            email.save(update_fields=['attempts', 'last_error', 'claimed_at'])
+
+
+def is_connection_error(error):
+    """
+    Whether the SMTP connection itself failed, rather than the server refusing
+    one message. SMTPException subclasses OSError, so plain socket errors are
+    told apart from protocol replies.
+    """
+    if isinstance(error, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError)):
+        return True
+    return isinstance(error, OSError) and not isinstance(error, smtplib.SMTPException)
+
+
+def reopen(connection):
+    """
+    Swap a dropped SMTP connection for a fresh one so the rest of the batch is not
+    failed with it. If the server stays unreachable the next send fails on its own.
+    """
+    for step in (connection.close, connection.open):
+        try:
+            step()
+        except OSError:
+            pass
+
+
+@app.task
+def purge_dead_mail():
+    """
+    Report queued emails that ran out of attempts and delete those older than
+    MAIL_DEAD_RETENTION, which leaves recent failures in place for inspection.
+    """
+    dead = QueuedEmail.objects.filter(attempts__gte=settings.MAIL_MAX_ATTEMPTS)
+    for email_id, to_email, last_error in dead.values_list('id', 'to_email', 'last_error').iterator():
+        logger.warning('Queued email %s to %s gave up after %s attempts: %s',
+                       email_id, to_email, settings.MAIL_MAX_ATTEMPTS, last_error)
+    expiry = datetime.now(tz=timezone.utc) - settings.MAIL_DEAD_RETENTION
+    dead.filter(created_at__lte=expiry).delete()
+
+
+@app.task
+def publish_ticket_events():
+    """
+    Relay unpublished outbox rows to their notification tasks in batches.
+    Rows are claimed with SKIP LOCKED, so concurrent relays do not publish the
+    same rows, and marked published in the same transaction.
+
+    Delivery is at least once: if the mark or the commit fails after the tasks
+    were enqueued, the rows are relayed again. The tasks receive the event id
+    and notify once per event, so a repeat is harmless.
+    """
+    notifications = {
+        Ticket.RESERVED: notify_user_on_reservation,
+        Ticket.CONFIRMED: notify_user_on_confirmed_ticket,
+    }
+    pending = TicketEvent.objects.filter(published_at__isnull=True).order_by('id')
+
+    while True:
+        with transaction.atomic():
+            batch = list(
+                pending.select_for_update(skip_locked=True).values_list('id', 'ticket_id', 'event')[
+                    :settings.OUTBOX_BATCH_SIZE]
+            )
+            if not batch:
+                return
+            for event_id, ticket_id, event in batch:
+                notifications[event].delay(ticket_id, event_id)
+            TicketEvent.objects.filter(
+                id__in=[event_id for event_id, _, _ in batch]
+            ).update(published_at=datetime.now(tz=timezone.utc))
+
+
+@app.task
+def purge_expired_idempotency_keys():
+    expiry = datetime.now(tz=timezone.utc) - settings.IDEMPOTENCY_KEY_TTL
+    IdempotencyKey.objects.filter(created_at__lte=expiry).delete()
+
+
+@app.task
+def purge_published_ticket_events():
+    expiry = datetime.now(tz=timezone.utc) - settings.OUTBOX_RETENTION
+    TicketEvent.objects.filter(published_at__lte=expiry).delete()
+
+
+@app.task
+def generate_scheduled_flights():
+    """
+    Fill in scheduled flights up to FLIGHT_SCHEDULE_HORIZON_DAYS ahead. Only the
+    days that came into the horizon since the last run are inserted.
+    """
+    today = date.today()
+    FlightSchedule.objects.generate(today, today + timedelta(days=settings.FLIGHT_SCHEDULE_HORIZON_DAYS))
@@ -13,3 +13,18 @@ class FlightFactory(factory.DjangoModelFactory):
 class TicketFactory(factory.DjangoModelFactory):
     class Meta:
         model = Ticket
+
+
+class QueryCountMixin(object):
+
+    def assertFixedQueryCount(self, expected, view, build_request, add_rows, **kwargs):
+        """
+        Assert an endpoint runs the same number of queries before and after more rows exist.
+        The first request only warms the cached user snapshot and is not counted.
+        """
+        view(build_request(), **kwargs)
+        for _ in range(2):
+            with self.assertNumQueries(expected):
+                response = view(build_request(), **kwargs)
+            self.assertEqual(response.status_code, 200)
+            add_rows()
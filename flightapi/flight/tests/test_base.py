@@ -1,15 +1,43 @@
 import datetime
+import json
+import os
+import tempfile
+import threading
+import time
+from io import StringIO
+from types import SimpleNamespace
+from urllib.parse import urlencode
+
+from smtplib import SMTPException, SMTPServerDisconnected
+
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail.backends import locmem
+from django.core.management import CommandError, call_command
+from django.test import TestCase, override_settings
 from django.urls import reverse
+from rest_framework.renderers import JSONRenderer
 from rest_framework.test import APITestCase, APIRequestFactory
 from portfolio.tests.factories import login_user, UserFactory
-from flight.api.views import FlightViewSet, TicketViewSet
-from flight.tests.factories import FlightFactory, TicketFactory
-from flight.models import Flight, Ticket
+from flight.api.serializers import FlightSerializer, TicketSerializer, values_serializer
+from flight import cache as flight_cache
+from flight.api.views import (DispatchMetricsView, FlightCacheMetricsView, FlightScheduleViewSet, FlightViewSet,
+                              TicketViewSet)
+from flight.decorators import reclaim_key
+from flight.dispatch import background_queue, dispatch, metrics
+from flight.importer import FlightImporter
+from flight.local_cache import LocalCache, local_cache
+from flightapi.celeryapp import app as celery_app
+from flight.tests.factories import FlightFactory, QueryCountMixin, TicketFactory
+from flight.models import Flight, FlightSchedule, IdempotencyKey, QueuedEmail, ReservationCounter, Ticket, TicketEvent
+from flight.tasks import (publish_ticket_events, purge_dead_mail, purge_published_ticket_events, send_queued_mail,
+                          send_reminder_to_travellers)
+from flight.utils import booking_reference
 
 from portfolio.models import User
 
 
-class TestFlightViewSet(APITestCase):
+class TestFlightViewSet(QueryCountMixin, APITestCase):
 
     def setUp(self):
         self.admin = UserFactory(
@@ -98,6 +126,42 @@ class TestFlightViewSet(APITestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.data['status'], Flight.LANDED)
 
+    def patch_capacity(self, capacity):
+        url = reverse('flights-detail', args=(self.flight.pk,))
+        view = FlightViewSet.as_view(
+            actions={
+                'patch': 'partial_update'
+            }
+        )
+        request = self.factory.patch(url, data=dict(capacity=capacity), HTTP_AUTHORIZATION='JWT {}'.format(
+            self.admin_token), format='json')
+        return view(request, pk=self.flight.pk)
+
+    def test_set_capacity_on_unlimited_flight_counts_tickets(self):
+        TicketFactory(flight=self.flight, user=self.user)
+
+        response = self.patch_capacity(3)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['seats_remaining'], 2)
+        self.assertEqual(Flight.objects.get(pk=self.flight.pk).seats_remaining, 2)
+
+    def test_change_capacity_moves_seats_remaining(self):
+        Flight.objects.filter(pk=self.flight.pk).update(capacity=10, seats_remaining=4)
+
+        self.assertEqual(self.patch_capacity(12).data['seats_remaining'], 6)
+        # Six seats are sold, so shrinking below that leaves none rather than a negative count
+        self.assertEqual(self.patch_capacity(5).data['seats_remaining'], 0)
+        self.assertIsNone(self.patch_capacity(None).data['seats_remaining'])
+
+    def test_saving_a_flight_keeps_seats_sold_since_it_was_loaded(self):
+        Flight.objects.filter(pk=self.flight.pk).update(capacity=10, seats_remaining=10)
+        flight = Flight.objects.get(pk=self.flight.pk)
+        Flight.objects.take_seat(flight.pk)
+
+        flight.status = Flight.DELAYED
+        flight.save()
+        self.assertEqual(Flight.objects.get(pk=flight.pk).seats_remaining, 9)
+
     def test_update_flight_status_non_admin(self):
         url = reverse('flights-flight-status', args=(self.flight.pk,))
         view = FlightViewSet.as_view(
@@ -209,6 +273,110 @@ class TestFlightViewSet(APITestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.data['reservations_count'], 1)    
 
+    def test_tickets_confirmed_for_flight_excludes_other_days(self):
+        ticket = TicketFactory(
+            status=Ticket.CONFIRMED,
+            flight=self.flight,
+            user=self.user,
+        )
+        Ticket.objects.filter(pk=ticket.pk).update(
+            confirmed_from=datetime.datetime(2018, 12, 24, 23, 59, tzinfo=datetime.timezone.utc)
+        )
+        url = reverse('flights-reserved', args=(self.flight.pk, '2018-12-25'))
+        view = FlightViewSet.as_view(
+            actions={
+                'get': 'reserved'
+            }
+        )
+        request = self.factory.get(url, HTTP_AUTHORIZATION='JWT {}'.format(
+            self.admin_token))
+
+        response = view(request, pk=self.flight.pk, date='2018-12-25')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['reservations_count'], 0)
+
+    def test_tickets_confirmed_for_flight_invalid_date(self):
+        url = reverse('flights-reserved', args=(self.flight.pk, '2018-13-45'))
+        view = FlightViewSet.as_view(
+            actions={
+                'get': 'reserved'
+            }
+        )
+        request = self.factory.get(url, HTTP_AUTHORIZATION='JWT {}'.format(
+            self.admin_token))
+
+        response = view(request, pk=self.flight.pk, date='2018-13-45')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['message'], 'date must be in the format YYYY-MM-DD')
+
+    def test_reservation_counts_per_day(self):
+        confirmed_on = (
+            datetime.datetime(2018, 12, 24, 8, 0, tzinfo=datetime.timezone.utc),
+            datetime.datetime(2018, 12, 24, 22, 0, tzinfo=datetime.timezone.utc),
+            datetime.datetime(2018, 12, 26, 9, 30, tzinfo=datetime.timezone.utc),
+            datetime.datetime(2018, 12, 28, 9, 30, tzinfo=datetime.timezone.utc),
+        )
+        for confirmed_from in confirmed_on:
+            ticket = TicketFactory(
+                status=Ticket.CONFIRMED,
+                flight=self.flight,
+                user=UserFactory(),
+            )
+            Ticket.objects.filter(pk=ticket.pk).update(confirmed_from=confirmed_from)
+        call_command('rebuild_reservation_counters', stdout=StringIO())
+
+        url = reverse('flights-reservation-counts', args=(self.flight.pk,))
+        view = FlightViewSet.as_view(
+            actions={
+                'get': 'reservation_counts'
+            }
+        )
+        request = self.factory.get(url, data=dict(date_from='2018-12-24', date_to='2018-12-27'),
+                                   HTTP_AUTHORIZATION='JWT {}'.format(self.admin_token))
+
+        response = view(request, pk=self.flight.pk)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['reservations'], [
+            dict(date='2018-12-24', count=2),
+            dict(date='2018-12-26', count=1),
+        ])
+
+    def test_reservation_counters_follow_ticket_status(self):
+        ticket = TicketFactory(
+            status=Ticket.RESERVED,
+            flight=self.flight,
+            user=self.user,
+        )
+        ticket.status = Ticket.BOOKED
+        ticket.save()
+        ticket = Ticket.objects.get(pk=ticket.pk)
+        ticket.status = Ticket.CONFIRMED
+        ticket.save()
+
+        counters = dict(
+            ReservationCounter.objects.filter(flight=self.flight).values_list('status', 'count')
+        )
+        self.assertEqual(counters, {Ticket.RESERVED: 0, Ticket.BOOKED: 0, Ticket.CONFIRMED: 1})
+
+        ticket.delete()
+        self.assertEqual(
+            ReservationCounter.objects.get(flight=self.flight, status=Ticket.CONFIRMED).count, 0
+        )
+
+    def test_reservation_counts_without_range_fail(self):
+        url = reverse('flights-reservation-counts', args=(self.flight.pk,))
+        view = FlightViewSet.as_view(
+            actions={
+                'get': 'reservation_counts'
+            }
+        )
+        request = self.factory.get(url, data=dict(date_from='2018-12-24'),
+                                   HTTP_AUTHORIZATION='JWT {}'.format(self.admin_token))
+
+        response = view(request, pk=self.flight.pk)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['message'], 'A valid date_from and date_to range is required')
+
     def test_reserve_ticket_already_exist(self):
         TicketFactory(
             status=Ticket.BOOKED,
@@ -245,7 +413,395 @@ class TestFlightViewSet(APITestCase):
         self.assertEqual(response.data['arrival_location'], 'Germany')
         self.assertEqual(response.data['departure_location'], 'lagos')      
 
-class TestTicketViewSet(APITestCase):
+    def test_reserve_ticket_takes_seat(self):
+        flight = FlightFactory(
+            flight_number="KF40C",
+            arrival_location="Germany",
+            departure_location="lagos",
+            capacity=2
+        )
+        url = reverse('flights-reserve', args=(flight.pk,))
+        view = FlightViewSet.as_view(
+            actions={
+                'post': 'reserve'
+            }
+        )
+        request = self.factory.post(url, HTTP_AUTHORIZATION='JWT {}'.format(
+            self.user_token))
+
+        response = view(request, pk=flight.pk)
+        flight.refresh_from_db()
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(flight.seats_remaining, 1)
+
+    def test_reserve_ticket_sold_out(self):
+        flight = FlightFactory(
+            flight_number="KF41D",
+            arrival_location="Germany",
+            departure_location="lagos",
+            capacity=0
+        )
+        url = reverse('flights-reserve', args=(flight.pk,))
+        view = FlightViewSet.as_view(
+            actions={
+                'post': 'reserve'
+            }
+        )
+        request = self.factory.post(url, HTTP_AUTHORIZATION='JWT {}'.format(
+            self.user_token))
+
+        response = view(request, pk=flight.pk)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['message'], 'This flight is sold out')
+        self.assertFalse(Ticket.objects.filter(flight=flight).exists())
+
+    def test_book_flight_sold_out(self):
+        flight = FlightFactory(
+            flight_number="KF42E",
+            arrival_location="Germany",
+            departure_location="lagos",
+            capacity=1
+        )
+        TicketFactory(
+            status=Ticket.BOOKED,
+            flight=flight,
+            user=self.admin
+        )
+        Flight.objects.take_seat(flight.pk)
+
+        url = reverse('flights-book', args=(flight.pk,))
+        view = FlightViewSet.as_view(
+            actions={
+                'post': 'book'
+            }
+        )
+        request = self.factory.post(url, HTTP_AUTHORIZATION='JWT {}'.format(
+            self.user_token))
+
+        response = view(request, pk=flight.pk)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['message'], 'This flight is sold out')
+
+    def test_book_flight_with_reserved_ticket(self):
+        flight = FlightFactory(
+            flight_number="KF43F",
+            arrival_location="Germany",
+            departure_location="lagos",
+            capacity=5
+        )
+        ticket = TicketFactory(
+            status=Ticket.RESERVED,
+            flight=flight,
+            user=self.user
+        )
+        Flight.objects.take_seat(flight.pk)
+
+        url = reverse('flights-book', args=(flight.pk,))
+        view = FlightViewSet.as_view(
+            actions={
+                'post': 'book'
+            }
+        )
+        request = self.factory.post(url, HTTP_AUTHORIZATION='JWT {}'.format(
+            self.user_token))
+
+        response = view(request, pk=flight.pk)
+        flight.refresh_from_db()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['id'], ticket.pk)
+        self.assertEqual(response.data['status'], Ticket.BOOKED)
+        self.assertEqual(flight.seats_remaining, 4)
+
+    def test_reserve_ticket_idempotent_replay(self):
+        url = reverse('flights-reserve', args=(self.flight.pk,))
+        view = FlightViewSet.as_view(
+            actions={
+                'post': 'reserve'
+            }
+        )
+        request = self.factory.post(url, HTTP_AUTHORIZATION='JWT {}'.format(
+            self.user_token), HTTP_IDEMPOTENCY_KEY='reserve-kf35z')
+        first_response = view(request, pk=self.flight.pk)
+
+        request = self.factory.post(url, HTTP_AUTHORIZATION='JWT {}'.format(
+            self.user_token), HTTP_IDEMPOTENCY_KEY='reserve-kf35z')
+        second_response = view(request, pk=self.flight.pk)
+
+        self.assertEqual(first_response.status_code, 201)
+        self.assertEqual(second_response.status_code, 201)
+        self.assertEqual(second_response.data, first_response.data)
+        self.assertEqual(second_response['Idempotent-Replayed'], 'true')
+        self.assertEqual(Ticket.objects.filter(flight=self.flight).count(), 1)
+
+    def test_idempotency_key_reused_for_different_request(self):
+        reserve_url = reverse('flights-reserve', args=(self.flight.pk,))
+        view = FlightViewSet.as_view(
+            actions={
+                'post': 'reserve'
+            }
+        )
+        request = self.factory.post(reserve_url, HTTP_AUTHORIZATION='JWT {}'.format(
+            self.user_token), HTTP_IDEMPOTENCY_KEY='reused-key')
+        view(request, pk=self.flight.pk)
+
+        book_url = reverse('flights-book', args=(self.flight.pk,))
+        view = FlightViewSet.as_view(
+            actions={
+                'post': 'book'
+            }
+        )
+        request = self.factory.post(book_url, HTTP_AUTHORIZATION='JWT {}'.format(
+            self.user_token), HTTP_IDEMPOTENCY_KEY='reused-key')
+        response = view(request, pk=self.flight.pk)
+
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(response.data['message'], 'Idempotency-Key has already been used for a different request')
+        self.assertEqual(Ticket.objects.get(flight=self.flight).status, Ticket.RESERVED)
+
+    def test_expired_idempotency_key_reclaimed_once(self):
+        record = IdempotencyKey.objects.create(
+            key='old-key', user=self.user, request_method='POST', request_path='/old/')
+        IdempotencyKey.objects.filter(pk=record.pk).update(
+            created_at=datetime.datetime(2017, 1, 1, tzinfo=datetime.timezone.utc), response_status=201)
+        first_retry = IdempotencyKey.objects.get(pk=record.pk)
+        second_retry = IdempotencyKey.objects.get(pk=record.pk)
+        request = SimpleNamespace(user=self.user, method='POST', path='/new/')
+
+        claimed = reclaim_key(request, first_retry)
+        self.assertIsNone(claimed.response_status)
+        self.assertFalse(claimed.is_expired)
+        claimed.response_status = 200
+        claimed.save(update_fields=['response_status'])
+
+        # The slower retry loses the conditional update and replays the winner's response
+        self.assertEqual(reclaim_key(request, second_retry).response_status, 200)
+        self.assertEqual(IdempotencyKey.objects.get(pk=record.pk).request_path, '/new/')
+
+    def test_tickets_confirmed_for_flight_query_count_is_fixed(self):
+        date = datetime.datetime.now().strftime('%Y-%m-%d')
+        url = reverse('flights-reserved', args=(self.flight.pk, date))
+        view = FlightViewSet.as_view(
+            actions={
+                'get': 'reserved'
+            }
+        )
+        self.assertFixedQueryCount(
+            3, view, lambda: self.factory.get(url, HTTP_AUTHORIZATION='JWT {}'.format(self.admin_token)),
+            lambda: TicketFactory(status=Ticket.CONFIRMED, flight=self.flight, user=UserFactory()),
+            pk=self.flight.pk, date=date
+        )
+
+    def test_search_flight_success(self):
+        FlightFactory(
+            flight_number="KF36A",
+            arrival_location="Germany",
+            departure_location="lagos",
+            departure_date='2017-12-15',
+        )
+        FlightFactory(
+            flight_number="KF37B",
+            arrival_location="Ghana",
+            departure_location="lagos",
+            departure_date='2017-11-30',
+        )
+        url = reverse('flights-search')
+        view = FlightViewSet.as_view(
+            actions={
+                'get': 'search'
+            }
+        )
+        request = self.factory.get(url, data=dict(
+            departure_location='lagos',
+            arrival_location='Germany',
+            departure_date_from='2017-11-01',
+            departure_date_to='2017-11-30',
+        ), HTTP_AUTHORIZATION='JWT {}'.format(self.user_token))
+
+        response = view(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['flight_number'], 'KF35Z')
+
+    def test_search_flight_pages_in_departure_order(self):
+        for flight_number, departure_date in (('KF40A', '2017-11-02'), ('KF40B', '2017-11-01'),
+                                              ('KF40C', '2017-11-02')):
+            FlightFactory(
+                flight_number=flight_number,
+                arrival_location="Germany",
+                departure_location="lagos",
+                departure_time="10:30",
+                departure_date=departure_date,
+            )
+        view = FlightViewSet.as_view(
+            actions={
+                'get': 'search'
+            }
+        )
+        url = '{}?{}'.format(reverse('flights-search'), urlencode(dict(
+            departure_location='lagos', arrival_location='Germany', page_size=2)))
+
+        flight_numbers = []
+        while url:
+            response = view(self.factory.get(url, HTTP_AUTHORIZATION='JWT {}'.format(self.user_token)))
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.data['results']), 2)
+            flight_numbers.extend(flight['flight_number'] for flight in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(flight_numbers, ['KF40B', 'KF40A', 'KF40C', 'KF35Z'])
+
+    def test_search_flight_by_status(self):
+        url = reverse('flights-search')
+        view = FlightViewSet.as_view(
+            actions={
+                'get': 'search'
+            }
+        )
+        request = self.factory.get(url, data=dict(
+            departure_location='lagos',
+            arrival_location='Germany',
+            status=Flight.DELAYED,
+        ), HTTP_AUTHORIZATION='JWT {}'.format(self.user_token))
+
+        response = view(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 0)
+
+    def test_search_flight_without_route_fail(self):
+        url = reverse('flights-search')
+        view = FlightViewSet.as_view(
+            actions={
+                'get': 'search'
+            }
+        )
+        request = self.factory.get(url, data=dict(departure_location='lagos'),
+                                   HTTP_AUTHORIZATION='JWT {}'.format(self.user_token))
+
+        response = view(request)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['message'], 'departure_location and arrival_location are required')
+
+    def test_search_flight_invalid_date_fail(self):
+        url = reverse('flights-search')
+        view = FlightViewSet.as_view(
+            actions={
+                'get': 'search'
+            }
+        )
+        request = self.factory.get(url, data=dict(
+            departure_location='lagos',
+            arrival_location='Germany',
+            departure_date_from='30-11-2017',
+        ), HTTP_AUTHORIZATION='JWT {}'.format(self.user_token))
+
+        response = view(request)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['message'], 'departure dates must be in the format YYYY-MM-DD')
+
+    def test_bulk_create_flights_reports_invalid_rows(self):
+        url = reverse('flights-bulk')
+        view = FlightViewSet.as_view(
+            actions={
+                'post': 'bulk'
+            }
+        )
+        invalid = dict(self.flight_payload, departure_date='30-11-2017')
+        free = {field: value for field, value in self.flight_payload.items() if field != 'price'}
+        payload = [
+            dict(self.flight_payload, flight_number='BK001', capacity=20),
+            invalid,
+            dict(self.flight_payload, flight_number='BK002', price=1800, price_currency='USD'),
+            free,
+        ]
+        request = self.factory.post(url, payload, HTTP_AUTHORIZATION='JWT {}'.format(self.admin_token),
+                                    format='json')
+
+        response = view(request)
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual([error['index'] for error in response.data['errors']], [1, 3])
+        self.assertIn('departure_date', response.data['errors'][0]['errors'])
+        self.assertIn('price', response.data['errors'][1]['errors'])
+        self.assertEqual(Flight.objects.get(flight_number='BK001').seats_remaining, 20)
+        self.assertEqual(str(Flight.objects.get(flight_number='BK002').price.currency), 'USD')
+
+    def test_bulk_create_flights_not_admin_fail(self):
+        url = reverse('flights-bulk')
+        view = FlightViewSet.as_view(
+            actions={
+                'post': 'bulk'
+            }
+        )
+        request = self.factory.post(url, [self.flight_payload], HTTP_AUTHORIZATION='JWT {}'.format(self.user_token),
+                                    format='json')
+
+        response = view(request)
+        self.assertEqual(response.status_code, 403)
+
+    @override_settings(FLIGHT_BULK_CREATE_MAX_ROWS=1)
+    def test_bulk_create_too_many_flights_fail(self):
+        url = reverse('flights-bulk')
+        view = FlightViewSet.as_view(
+            actions={
+                'post': 'bulk'
+            }
+        )
+        request = self.factory.post(url, [self.flight_payload] * 2,
+                                    HTTP_AUTHORIZATION='JWT {}'.format(self.admin_token), format='json')
+
+        response = view(request)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Flight.objects.filter(flight_number='KF34R').count(), 0)
+
+    def test_import_schedule_csv(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as schedule:
+            schedule.write(
+                'flight_number,departure_location,arrival_location,departure_date,departure_time,'
+                'arrival_date,arrival_time,capacity,price\n'
+                'CS001,lagos,abuja,2017-11-30,10:30,2017-11-30,11:30,,2500\n'
+                'CS002,lagos,abuja,not-a-date,10:30,2017-11-30,11:30,40,2500\n'
+                'CS003,lagos,abuja,2017-12-01,10:30,2017-12-01,11:30,40,2500\n'
+                'CS004,lagos,abuja,2017-12-02,10:30,2017-12-02,11:30,40,\n'
+            )
+        self.addCleanup(os.remove, schedule.name)
+        stdout, stderr = StringIO(), StringIO()
+
+        call_command('import_schedule', schedule.name, batch_size=1, stdout=stdout, stderr=stderr)
+        self.assertIn('Imported 2 flights, skipped 2 invalid rows', stdout.getvalue())
+        self.assertIn('line 3:', stderr.getvalue())
+        self.assertIn('line 5: {"price"', stderr.getvalue())
+        self.assertIsNone(Flight.objects.get(flight_number='CS001').capacity)
+        self.assertEqual(Flight.objects.get(flight_number='CS003').seats_remaining, 40)
+
+    def test_import_schedule_rejects_empty_batches(self):
+        with self.assertRaisesMessage(CommandError, '--batch-size must be at least 1'):
+            call_command('import_schedule', 'schedule.csv', batch_size=0)
+
+    def test_import_database_error_fails_only_its_row(self):
+        errors = []
+        importer = FlightImporter(10, lambda line, detail: errors.append(line))
+        importer.insert([
+            (1, Flight(flight_number='DB001', price=2500, capacity=5, seats_remaining=5)),
+            (2, Flight(flight_number=None, price=2500, capacity=5, seats_remaining=5)),
+        ])
+
+        self.assertEqual((importer.created, importer.failed, errors), (1, 1, [2]))
+        self.assertTrue(Flight.objects.filter(flight_number='DB001').exists())
+
+    def test_import_schedule_jsonl(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False) as schedule:
+            schedule.write(json.dumps(dict(self.flight_payload, flight_number='JS001')) + '\n')
+            schedule.write('{"flight_number": \n')
+            schedule.write('\n')
+            schedule.write(json.dumps(dict(self.flight_payload, flight_number='JS002')) + '\n')
+        self.addCleanup(os.remove, schedule.name)
+        stdout, stderr = StringIO(), StringIO()
+
+        call_command('import_schedule', schedule.name, stdout=stdout, stderr=stderr)
+        self.assertIn('Imported 2 flights, skipped 1 invalid rows', stdout.getvalue())
+        self.assertIn('line 2: "Invalid JSON', stderr.getvalue())
+        self.assertEqual(Flight.objects.filter(flight_number__in=['JS001', 'JS002']).count(), 2)
+
+class TestTicketViewSet(QueryCountMixin, APITestCase):
 
     def setUp(self):
         self.admin = UserFactory(
@@ -300,50 +856,199 @@ class TestTicketViewSet(APITestCase):
         response = view(request)
 
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(len(response.data), 2)
+        self.assertEqual(len(response.data['results']), 2)
 
-    def test_book_ticket_success(self):
-        ticket = TicketFactory(
-            status=Ticket.RESERVED,
+    def test_list_ticket_cursor_pagination(self):
+        first_ticket = TicketFactory(
+            status=Ticket.CONFIRMED,
             flight=self.flight,
             user=self.user
         )
-        url = reverse('tickets-book', args=(ticket.pk,))
+        second_ticket = TicketFactory(
+            status=Ticket.RESERVED,
+            flight=self.flight,
+            user=UserFactory()
+        )
 
+        url = reverse('tickets-list')
         view = TicketViewSet.as_view(
             actions={
-                'patch': 'book'
+                'get': 'list'
             }
         )
-        request = self.factory.patch(url, HTTP_AUTHORIZATION='JWT {}'.format(
-            self.user_token))
-        response = view(request, pk=ticket.pk)
+        request = self.factory.get(url, data=dict(page_size=1), HTTP_AUTHORIZATION='JWT {}'.format(
+            self.admin_token))
+        response = view(request)
 
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(response.data['status'], Ticket.BOOKED)
+        self.assertEqual([ticket['id'] for ticket in response.data['results']], [first_ticket.pk])
+        self.assertIsNone(response.data['previous'])
+        self.assertIsNotNone(response.data['next'])
 
-    def test_book_ticket_unauthorized(self):
+        request = self.factory.get(response.data['next'], HTTP_AUTHORIZATION='JWT {}'.format(
+            self.admin_token))
+        response = view(request)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([ticket['id'] for ticket in response.data['results']], [second_ticket.pk])
+        self.assertIsNone(response.data['next'])
+
+    def test_destroy_ticket_releases_seat(self):
+        flight = FlightFactory(
+            flight_number="KF44G",
+            arrival_location="Germany",
+            departure_location="lagos",
+            capacity=1
+        )
         ticket = TicketFactory(
-            status=Ticket.BOOKED,
-            flight=self.flight,
+            status=Ticket.RESERVED,
+            flight=flight,
             user=self.user
         )
-        url = reverse('tickets-book', args=(ticket.pk,))
+        Flight.objects.take_seat(flight.pk)
 
+        url = reverse('tickets-detail', args=(ticket.pk,))
         view = TicketViewSet.as_view(
             actions={
-                'patch': 'book'
+                'delete': 'destroy'
             }
         )
-
-        request = self.factory.patch(url, HTTP_AUTHORIZATION='JWT {}'.format(
-            self.admin_token))
+        request = self.factory.delete(url, HTTP_AUTHORIZATION='JWT {}'.format(
+            self.user_token))
         response = view(request, pk=ticket.pk)
 
-        self.assertEqual(response.status_code, 401)
-        self.assertEqual(response.data['message'], "You are not authorized to book this ticket")
+        flight.refresh_from_db()
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(flight.seats_remaining, 1)
 
-    def test_book_ticket_with_status_booked(self):
+    def test_list_ticket_query_count_is_fixed(self):
+        url = reverse('tickets-list')
+        view = TicketViewSet.as_view(
+            actions={
+                'get': 'list'
+            }
+        )
+
+        def add_tickets():
+            for _ in range(3):
+                TicketFactory(flight=FlightFactory(flight_number="KF50H"), user=UserFactory())
+
+        add_tickets()
+        # Only the page itself; the validators come from the cache
+        self.assertFixedQueryCount(
+            1, view, lambda: self.factory.get(url, HTTP_AUTHORIZATION='JWT {}'.format(self.admin_token)),
+            add_tickets
+        )
+
+    def test_retrieve_ticket_query_count_is_fixed(self):
+        ticket = TicketFactory(
+            status=Ticket.RESERVED,
+            flight=self.flight,
+            user=self.user
+        )
+        url = reverse('tickets-detail', args=(ticket.pk,))
+        view = TicketViewSet.as_view(
+            actions={
+                'get': 'retrieve'
+            }
+        )
+        # The ETag validators plus the ticket itself
+        self.assertFixedQueryCount(
+            2, view, lambda: self.factory.get(url, HTTP_AUTHORIZATION='JWT {}'.format(self.user_token)),
+            lambda: TicketFactory(flight=self.flight, user=UserFactory()), pk=ticket.pk
+        )
+
+    def test_retrieve_ticket_non_numeric_id_not_found(self):
+        view = TicketViewSet.as_view(
+            actions={
+                'get': 'retrieve'
+            }
+        )
+        request = self.factory.get('/api/v1/ticket/abc/', HTTP_AUTHORIZATION='JWT {}'.format(self.user_token))
+
+        response = view(request, pk='abc')
+        self.assertEqual(response.status_code, 404)
+
+    def test_list_my_tickets(self):
+        TicketFactory(status=Ticket.CONFIRMED, flight=self.flight, user=self.user, departure_date='2017-11-30')
+        TicketFactory(status=Ticket.RESERVED, flight=FlightFactory(flight_number="KF50H"), user=self.user,
+                      departure_date='2017-12-30')
+        TicketFactory(status=Ticket.CONFIRMED, flight=FlightFactory(flight_number="KF51H"), user=self.admin,
+                      departure_date='2017-11-30')
+        view = TicketViewSet.as_view(
+            actions={
+                'get': 'mine'
+            }
+        )
+        url = reverse('tickets-mine')
+        request = self.factory.get(url, dict(status=Ticket.CONFIRMED, departure_date_to='2017-12-01'),
+                                   HTTP_AUTHORIZATION='JWT {}'.format(self.user_token))
+        response = view(request)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['flight']['flight_number'], 'KF35Z')
+
+        request = self.factory.get(url, dict(status='LOST'), HTTP_AUTHORIZATION='JWT {}'.format(self.user_token))
+        response = view(request)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['message'], 'ticket status is incorrect')
+
+    def test_my_tickets_query_count_is_fixed(self):
+        view = TicketViewSet.as_view(
+            actions={
+                'get': 'mine'
+            }
+        )
+        url = reverse('tickets-mine')
+        # The ETag aggregate plus the page itself
+        self.assertFixedQueryCount(
+            2, view, lambda: self.factory.get(url, HTTP_AUTHORIZATION='JWT {}'.format(self.user_token)),
+            lambda: TicketFactory(flight=FlightFactory(flight_number="KF50H"), user=self.user)
+        )
+
+    def test_book_ticket_success(self):
+        ticket = TicketFactory(
+            status=Ticket.RESERVED,
+            flight=self.flight,
+            user=self.user
+        )
+        url = reverse('tickets-book', args=(ticket.pk,))
+
+        view = TicketViewSet.as_view(
+            actions={
+                'patch': 'book'
+            }
+        )
+        request = self.factory.patch(url, HTTP_AUTHORIZATION='JWT {}'.format(
+            self.user_token))
+        response = view(request, pk=ticket.pk)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['status'], Ticket.BOOKED)
+
+    def test_book_ticket_unauthorized(self):
+        ticket = TicketFactory(
+            status=Ticket.BOOKED,
+            flight=self.flight,
+            user=self.user
+        )
+        url = reverse('tickets-book', args=(ticket.pk,))
+
+        view = TicketViewSet.as_view(
+            actions={
+                'patch': 'book'
+            }
+        )
+
+        request = self.factory.patch(url, HTTP_AUTHORIZATION='JWT {}'.format(
+            self.admin_token))
+        response = view(request, pk=ticket.pk)
+
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.data['message'], "You are not authorized to book this ticket")
+
+    def test_book_ticket_with_status_booked(self):
         ticket = TicketFactory(
         status=Ticket.BOOKED,
         flight=self.flight,
@@ -384,6 +1089,185 @@ class TestTicketViewSet(APITestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.data['status'], Ticket.CONFIRMED)
 
+    def test_purchase_ticket_writes_one_outbox_event(self):
+        ticket = TicketFactory(
+            status=Ticket.BOOKED,
+            flight=self.flight,
+            user=self.user
+        )
+        url = reverse('tickets-purchase', args=(ticket.pk,))
+
+        view = TicketViewSet.as_view(
+            actions={
+                'post': 'purchase'
+            }
+        )
+        request = self.factory.post(url, HTTP_AUTHORIZATION='JWT {}'.format(
+            self.user_token))
+        view(request, pk=ticket.pk)
+
+        self.assertEqual(list(ticket.events.values_list('event', flat=True)), [Ticket.CONFIRMED])
+
+        publish_ticket_events()
+        publish_ticket_events()
+
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].subject, 'Your ticket plan')
+        self.assertFalse(TicketEvent.objects.filter(published_at__isnull=True).exists())
+
+    def test_redelivered_outbox_event_notifies_once(self):
+        ticket = TicketFactory(
+            status=Ticket.RESERVED,
+            flight=self.flight,
+            user=self.user
+        )
+        ticket.status = Ticket.CONFIRMED
+        ticket.save()
+        publish_ticket_events()
+
+        # As if the relay died after enqueueing but before marking the rows published
+        TicketEvent.objects.update(published_at=None)
+        publish_ticket_events()
+
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(sorted(message.subject for message in mail.outbox), ['Your Flight Plan', 'Your ticket plan'])
+        self.assertFalse(TicketEvent.objects.filter(notified_at__isnull=True).exists())
+
+    def test_purge_published_ticket_events(self):
+        ticket = TicketFactory(
+            status=Ticket.RESERVED,
+            flight=self.flight,
+            user=self.user
+        )
+        publish_ticket_events()
+        TicketEvent.objects.update(published_at=datetime.datetime(2017, 1, 1, tzinfo=datetime.timezone.utc))
+        TicketEvent.objects.create(ticket=ticket, event=Ticket.CONFIRMED)
+
+        purge_published_ticket_events()
+        self.assertEqual(list(TicketEvent.objects.values_list('event', flat=True)), [Ticket.CONFIRMED])
+
+    def test_purchase_ticket_idempotent_replay(self):
+        ticket = TicketFactory(
+            status=Ticket.BOOKED,
+            flight=self.flight,
+            user=self.user
+        )
+        url = reverse('tickets-purchase', args=(ticket.pk,))
+
+        view = TicketViewSet.as_view(
+            actions={
+                'post': 'purchase'
+            }
+        )
+        request = self.factory.post(url, HTTP_AUTHORIZATION='JWT {}'.format(
+            self.user_token), HTTP_IDEMPOTENCY_KEY='purchase-1')
+        first_response = view(request, pk=ticket.pk)
+
+        request = self.factory.post(url, HTTP_AUTHORIZATION='JWT {}'.format(
+            self.user_token), HTTP_IDEMPOTENCY_KEY='purchase-1')
+        second_response = view(request, pk=ticket.pk)
+
+        self.assertEqual(first_response.status_code, 200)
+        self.assertEqual(second_response.status_code, 200)
+        self.assertEqual(second_response.data['booking_reference'], first_response.data['booking_reference'])
+
+    def test_booking_reference_generated_once(self):
+        ticket = TicketFactory(status=Ticket.BOOKED, flight=self.flight, user=self.user)
+        self.assertIsNone(ticket.booking_reference)
+
+        ticket.status = Ticket.CONFIRMED
+        ticket.save()
+        reference, confirmed_from = ticket.booking_reference, ticket.confirmed_from
+        self.assertEqual(reference, booking_reference(ticket.pk))
+
+        ticket = Ticket.objects.get(pk=ticket.pk)
+        ticket.departure_time = '11:00'
+        ticket.save()
+        ticket.refresh_from_db()
+        self.assertEqual(ticket.booking_reference, reference)
+        self.assertEqual(ticket.confirmed_from, confirmed_from)
+
+        created_confirmed = TicketFactory(status=Ticket.CONFIRMED, flight=FlightFactory(), user=self.user)
+        created_confirmed.refresh_from_db()
+        self.assertEqual(created_confirmed.booking_reference, booking_reference(created_confirmed.pk))
+
+    def test_booking_references_are_unique(self):
+        ticket_ids = list(range(1, 20001)) + [2 ** 40 - 1, 2 ** 40, 2 ** 45]
+        references = [booking_reference(ticket_id) for ticket_id in ticket_ids]
+        self.assertEqual(len(set(references)), len(references))
+        self.assertEqual(len(references[0]), 8)
+        self.assertEqual(len(references[-1]), 10)
+
+    def test_batch_retrieve_tickets(self):
+        first = TicketFactory(flight=self.flight, user=self.user)
+        second = TicketFactory(flight=FlightFactory(flight_number="KF50H"), user=self.user)
+        foreign = TicketFactory(flight=self.flight, user=self.admin)
+        view = TicketViewSet.as_view(
+            actions={
+                'get': 'batch'
+            }
+        )
+        ids = '{},{},{},999999,{}'.format(second.pk, foreign.pk, first.pk, second.pk)
+        request = self.factory.get(reverse('tickets-batch'), dict(ids=ids),
+                                   HTTP_AUTHORIZATION='JWT {}'.format(self.user_token))
+        view(request)
+
+        request = self.factory.get(reverse('tickets-batch'), dict(ids=ids),
+                                   HTTP_AUTHORIZATION='JWT {}'.format(self.user_token))
+        with self.assertNumQueries(1):
+            response = view(request)
+
+        self.assertEqual(response.status_code, 200)
+        results = response.data['results']
+        self.assertEqual([result['id'] for result in results], [second.pk, foreign.pk, first.pk, 999999])
+        self.assertEqual([result['status'] for result in results], [200, 404, 200, 404])
+        self.assertEqual(results[0]['ticket']['flight']['flight_number'], 'KF50H')
+        self.assertEqual(results[1]['message'], 'Ticket not found')
+
+    @override_settings(TICKET_BATCH_MAX_IDS=2)
+    def test_batch_retrieve_tickets_invalid(self):
+        view = TicketViewSet.as_view(
+            actions={
+                'get': 'batch'
+            }
+        )
+        request = self.factory.get(reverse('tickets-batch'), dict(ids='1,2,3'),
+                                   HTTP_AUTHORIZATION='JWT {}'.format(self.user_token))
+        response = view(request)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['message'], 'At most 2 tickets can be retrieved at once')
+
+        request = self.factory.get(reverse('tickets-batch'), dict(ids='1,two'),
+                                   HTTP_AUTHORIZATION='JWT {}'.format(self.user_token))
+        response = view(request)
+        self.assertEqual(response.status_code, 400)
+
+    def test_retrieve_ticket_by_reference(self):
+        ticket = TicketFactory(status=Ticket.CONFIRMED, flight=self.flight, user=self.user)
+        ticket.refresh_from_db()
+        view = TicketViewSet.as_view(
+            actions={
+                'get': 'by_reference'
+            }
+        )
+        url = reverse('tickets-by-reference', args=(ticket.booking_reference.lower(),))
+
+        request = self.factory.get(url, HTTP_AUTHORIZATION='JWT {}'.format(self.user_token))
+        response = view(request, reference=ticket.booking_reference.lower())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['id'], ticket.pk)
+        self.assertEqual(response.data['flight']['flight_number'], 'KF35Z')
+
+        other_user = UserFactory(password='1234')
+        other_token = login_user(dict(email=other_user.email, password='1234')).data['token']
+        request = self.factory.get(url, HTTP_AUTHORIZATION='JWT {}'.format(other_token))
+        response = view(request, reference=ticket.booking_reference)
+        self.assertEqual(response.status_code, 404)
+
+        request = self.factory.get(url, HTTP_AUTHORIZATION='JWT {}'.format(self.admin_token))
+        response = view(request, reference=ticket.booking_reference)
+        self.assertEqual(response.status_code, 200)
+
     def test_purchase_ticket_fail_unauthorized(self):
         ticket = TicketFactory(
         status=Ticket.BOOKED,
@@ -501,4 +1385,547 @@ class TestTicketViewSet(APITestCase):
 
         response = view(request, pk=ticket.pk)
         self.assertEqual(response.status_code, 400)
-        self.assertEqual(response.data['message'], "Some of the fields provided are not permitted for this action")
\ No newline at end of file
+        self.assertEqual(response.data['message'], "Some of the fields provided are not permitted for this action")
+
+
+@override_settings(REMINDER_CHUNK_SIZE=1, FASTPACE_EMAIL='noreply@fastpace.com')
+class TestReminderTask(TestCase):
+
+    def setUp(self):
+        self.flight = FlightFactory(
+            flight_number="KF35Z",
+            arrival_location="Germany",
+            departure_location="lagos",
+        )
+
+    def create_ticket(self, status, days_to_departure):
+        return TicketFactory(
+            status=status,
+            flight=self.flight,
+            user=UserFactory(),
+            departure_date=datetime.date.today() + datetime.timedelta(days=days_to_departure)
+        )
+
+    def test_reminder_sent_for_every_confirmed_ticket_departing_soon(self):
+        departing_today = self.create_ticket(Ticket.CONFIRMED, 0)
+        departing_tomorrow = self.create_ticket(Ticket.CONFIRMED, 1)
+        self.create_ticket(Ticket.CONFIRMED, 5)
+        self.create_ticket(Ticket.CONFIRMED, -1)
+        self.create_ticket(Ticket.BOOKED, 1)
+
+        send_reminder_to_travellers()
+
+        recipients = sorted(message.to[0] for message in mail.outbox)
+        self.assertEqual(recipients, sorted([departing_today.user.email, departing_tomorrow.user.email]))
+        self.assertEqual(mail.outbox[0].subject, 'Reminder Event for Flight KF35Z')
+
+
+class FlakyEmailBackend(locmem.EmailBackend):
+    """
+    In-memory SMTP stand-in that counts connections and bounces some recipients.
+    """
+    connections_opened = 0
+    dropped = False
+
+    def open(self):
+        FlakyEmailBackend.connections_opened += 1
+        self.dropped = False
+        return True
+
+    def send_messages(self, messages):
+        recipients = [recipient for message in messages for recipient in message.to]
+        if self.dropped:
+            raise SMTPServerDisconnected('Connection unexpectedly closed')
+        if any(recipient.startswith('drop') for recipient in recipients):
+            self.dropped = True
+            raise SMTPServerDisconnected('Connection unexpectedly closed')
+        if any(recipient.startswith('bounce') for recipient in recipients):
+            raise SMTPException('Mailbox unavailable')
+        return super(FlakyEmailBackend, self).send_messages(messages)
+
+
+class TestBeatSchedule(TestCase):
+
+    def assertScheduled(self, entry, task_name):
+        schedule = celery_app.conf.CELERYBEAT_SCHEDULE
+        self.assertIn(entry, schedule)
+        self.assertEqual(schedule[entry]['task'], task_name)
+        self.assertIn(task_name, celery_app.tasks)
+
+    def test_outbox_relay_and_purge_scheduled(self):
+        self.assertScheduled('publish-ticket-events', 'flight.tasks.publish_ticket_events')
+        self.assertScheduled('purge-ticket-events', 'flight.tasks.purge_published_ticket_events')
+
+    def test_mail_queue_sweeps_scheduled(self):
+        self.assertScheduled('send-queued-mail', 'flight.tasks.send_queued_mail')
+        self.assertScheduled('purge-dead-mail', 'flight.tasks.purge_dead_mail')
+
+    def test_idempotency_key_purge_scheduled(self):
+        self.assertScheduled('purge-idempotency-keys', 'flight.tasks.purge_expired_idempotency_keys')
+
+    def test_flight_schedule_horizon_scheduled(self):
+        self.assertScheduled('generate-scheduled-flights', 'flight.tasks.generate_scheduled_flights')
+
+
+@override_settings(EMAIL_BACKEND='flight.tests.test_base.FlakyEmailBackend', MAIL_BATCH_SIZE=2, MAIL_MAX_ATTEMPTS=2)
+class TestMailQueue(TestCase):
+
+    def setUp(self):
+        FlakyEmailBackend.connections_opened = 0
+        for recipient in ('ada@gmail.com', 'bounce@gmail.com', 'tolu@gmail.com', 'femi@gmail.com'):
+            QueuedEmail.objects.create(subject='Your Flight Plan', body='Hello', to_email=recipient)
+
+    def test_queued_mail_sent_in_batches_over_one_connection(self):
+        send_queued_mail()
+
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox),
+                         ['ada@gmail.com', 'femi@gmail.com', 'tolu@gmail.com'])
+        self.assertEqual(FlakyEmailBackend.connections_opened, 2)
+
+    def test_failed_mail_retried_until_max_attempts(self):
+        send_queued_mail()
+        bounced = QueuedEmail.objects.get()
+        self.assertEqual(bounced.to_email, 'bounce@gmail.com')
+        self.assertEqual(bounced.attempts, 1)
+        self.assertEqual(bounced.last_error, 'Mailbox unavailable')
+
+        send_queued_mail()
+        send_queued_mail()
+        self.assertEqual(QueuedEmail.objects.get().attempts, 2)
+        self.assertEqual(len(mail.outbox), 3)
+
+    def test_claimed_mail_skipped_until_claim_expires(self):
+        QueuedEmail.objects.update(claimed_at=datetime.datetime.now(tz=datetime.timezone.utc))
+        send_queued_mail()
+        self.assertEqual(len(mail.outbox), 0)
+
+        QueuedEmail.objects.update(claimed_at=datetime.datetime(2017, 1, 1, tzinfo=datetime.timezone.utc))
+        send_queued_mail()
+        self.assertEqual(len(mail.outbox), 3)
+
+    @override_settings(MAIL_BATCH_SIZE=10)
+    def test_dropped_connection_reopened_for_rest_of_batch(self):
+        QueuedEmail.objects.all().delete()
+        for recipient in ('drop@gmail.com', 'ada@gmail.com', 'tolu@gmail.com'):
+            QueuedEmail.objects.create(subject='Your Flight Plan', body='Hello', to_email=recipient)
+        send_queued_mail()
+
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), ['ada@gmail.com', 'tolu@gmail.com'])
+        self.assertEqual(FlakyEmailBackend.connections_opened, 2)
+        self.assertEqual(QueuedEmail.objects.get(to_email='drop@gmail.com').attempts, 1)
+
+    def test_dead_mail_reported_and_purged(self):
+        QueuedEmail.objects.filter(to_email='bounce@gmail.com').update(
+            attempts=2, last_error='Mailbox unavailable',
+            created_at=datetime.datetime(2017, 1, 1, tzinfo=datetime.timezone.utc))
+        QueuedEmail.objects.filter(to_email='tolu@gmail.com').update(attempts=2, last_error='Mailbox unavailable')
+
+        with self.assertLogs('flight.tasks', 'WARNING') as logs:
+            purge_dead_mail()
+        self.assertEqual(len(logs.output), 2)
+        self.assertEqual(sorted(QueuedEmail.objects.values_list('to_email', flat=True)),
+                         ['ada@gmail.com', 'femi@gmail.com', 'tolu@gmail.com'])
+
+
+@override_settings(NOTIFICATION_DISPATCH='thread')
+class TestNotificationDispatch(APITestCase):
+
+    def setUp(self):
+        metrics.reset()
+        self.admin = UserFactory(
+            is_staff=True,
+            email='imisioluwa.akande@gmail.com',
+            password='1234',
+        )
+        self.admin_token = login_user(dict(email=self.admin.email, password='1234')).data['token']
+        self.factory = APIRequestFactory()
+
+    def test_thread_dispatch_returns_before_task_runs(self):
+        release = threading.Event()
+        finished = []
+
+        def slow_notification(ticket_id):
+            release.wait(5)
+            finished.append(ticket_id)
+
+        dispatch(slow_notification, 7)
+        self.assertEqual(finished, [])
+
+        release.set()
+        background_queue().join()
+        self.assertEqual(finished, [7])
+
+        stats = metrics.snapshot()['modes']['thread']
+        self.assertEqual(stats['dispatched'], 1)
+        self.assertEqual(stats['completed'], 1)
+        self.assertEqual(stats['failed'], 0)
+
+    @override_settings(NOTIFICATION_DISPATCH='celery')
+    def test_broker_error_logged_and_counted(self):
+        class BrokerDown(object):
+            name = 'flight.tasks.publish_ticket_events'
+
+            def delay(self, *args):
+                raise OSError('Connection refused')
+
+        with self.assertLogs('flight.dispatch', 'ERROR') as logs:
+            dispatch(BrokerDown())
+
+        self.assertIn('flight.tasks.publish_ticket_events', logs.output[0])
+        stats = metrics.snapshot()['modes']['celery']
+        self.assertEqual(stats['enqueue_failed'], 1)
+        self.assertEqual(stats['dispatched'], 0)
+
+    def test_dispatch_metrics_admin_only(self):
+        url = reverse('dispatch_metrics')
+        request = self.factory.get(url, HTTP_AUTHORIZATION='JWT {}'.format(self.admin_token))
+        response = DispatchMetricsView.as_view()(request)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['mode'], 'thread')
+
+
+class TestFlightSchedule(APITestCase):
+
+    def setUp(self):
+        self.admin = UserFactory(
+            is_staff=True,
+            email='imisioluwa.akande@gmail.com',
+            password='1234',
+        )
+        self.user = UserFactory(
+            email='sola.smith@gmail.com',
+            password='1234'
+        )
+        self.admin_token = login_user(dict(email=self.admin.email, password='1234')).data['token']
+        self.user_token = login_user(dict(email=self.user.email, password='1234')).data['token']
+        self.factory = APIRequestFactory()
+        # 2018-01-01 is a Monday
+        self.schedule = FlightSchedule.objects.create(
+            flight_number='FS100',
+            departure_location='lagos',
+            arrival_location='london',
+            departure_time='23:00',
+            arrival_time='05:30',
+            arrival_day_offset=1,
+            days_of_week='135',
+            valid_from=datetime.date(2018, 1, 2),
+            valid_until=datetime.date(2018, 1, 31),
+            price=2500,
+            capacity=120,
+        )
+        self.payload = dict(
+            flight_number='FS200',
+            departure_location='lagos',
+            arrival_location='abuja',
+            departure_time='08:00',
+            arrival_time='09:10',
+            days_of_week='71',
+            valid_from=str(datetime.date.today()),
+            price='1800.00',
+            capacity=50,
+        )
+
+    def test_generate_creates_operating_days_once(self):
+        created = FlightSchedule.objects.generate(datetime.date(2018, 1, 1), datetime.date(2018, 1, 7))
+        self.assertEqual(created, 2)
+        flights = self.schedule.flights.order_by('departure_date')
+        self.assertEqual([flight.departure_date for flight in flights],
+                         [datetime.date(2018, 1, 3), datetime.date(2018, 1, 5)])
+        self.assertEqual(flights[0].arrival_date, datetime.date(2018, 1, 4))
+        self.assertEqual(flights[0].seats_remaining, 120)
+        self.assertEqual(flights[0].flight_number, 'FS100')
+
+        self.assertEqual(FlightSchedule.objects.generate(datetime.date(2018, 1, 1), datetime.date(2018, 1, 7)), 0)
+
+        # Extending the horizon only adds the new days
+        self.assertEqual(FlightSchedule.objects.generate(datetime.date(2018, 1, 1), datetime.date(2018, 1, 10)), 2)
+        self.assertEqual(self.schedule.flights.count(), 4)
+
+    def test_generate_stops_at_valid_until(self):
+        FlightSchedule.objects.generate(datetime.date(2018, 1, 1), datetime.date(2018, 3, 1))
+        self.assertEqual(self.schedule.flights.count(), 13)
+        self.assertEqual(self.schedule.flights.latest('departure_date').departure_date, datetime.date(2018, 1, 31))
+
+    @override_settings(FLIGHT_SCHEDULE_HORIZON_DAYS=6)
+    def test_create_schedule_generates_flights(self):
+        url = reverse('flight_schedules-list')
+        view = FlightScheduleViewSet.as_view(actions={'post': 'create'})
+        request = self.factory.post(url, self.payload, HTTP_AUTHORIZATION='JWT {}'.format(self.admin_token),
+                                    format='json')
+
+        response = view(request)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['days_of_week'], '17')
+        schedule = FlightSchedule.objects.get(pk=response.data['id'])
+        # Seven days starting today hold exactly one Monday and one Sunday
+        self.assertEqual(schedule.flights.count(), 2)
+        self.assertEqual(str(schedule.flights.first().price.amount), '1800.00')
+
+    def test_create_schedule_invalid_days_fail(self):
+        url = reverse('flight_schedules-list')
+        view = FlightScheduleViewSet.as_view(actions={'post': 'create'})
+        request = self.factory.post(url, dict(self.payload, days_of_week='118'),
+                                    HTTP_AUTHORIZATION='JWT {}'.format(self.admin_token), format='json')
+
+        response = view(request)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('days_of_week', response.data)
+
+    def test_create_schedule_not_admin_fail(self):
+        url = reverse('flight_schedules-list')
+        view = FlightScheduleViewSet.as_view(actions={'post': 'create'})
+        request = self.factory.post(url, self.payload, HTTP_AUTHORIZATION='JWT {}'.format(self.user_token),
+                                    format='json')
+
+        response = view(request)
+        self.assertEqual(response.status_code, 403)
+
+    def test_generate_flights_command(self):
+        stdout = StringIO()
+        call_command('generate_flights', start='2018-01-01', days=6, stdout=stdout)
+        self.assertIn('Created 2 scheduled flights', stdout.getvalue())
+
+
+class TestFlightCache(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        local_cache().clear()
+        self.admin = UserFactory(
+            is_staff=True,
+            email='imisioluwa.akande@gmail.com',
+            password='1234',
+        )
+        self.admin_token = login_user(dict(email=self.admin.email, password='1234')).data['token']
+        self.factory = APIRequestFactory()
+        self.flight = FlightFactory(flight_number="KF35Z", capacity=10)
+        self.retrieve = FlightViewSet.as_view(actions={'get': 'retrieve'})
+
+    def get_flight(self):
+        url = reverse('flights-detail', args=(self.flight.pk,))
+        request = self.factory.get(url, HTTP_AUTHORIZATION='JWT {}'.format(self.admin_token))
+        return self.retrieve(request, pk=str(self.flight.pk))
+
+    def test_flight_detail_served_from_cache(self):
+        self.get_flight()
+        with self.assertNumQueries(0):
+            response = self.get_flight()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['flight_number'], 'KF35Z')
+        self.assertNotIn('updated_at', response.data)
+        self.assertEqual(flight_cache.stats(), dict(hits=0, misses=1, coalesced=0))
+
+        local_cache().clear()
+        self.get_flight()
+        self.assertEqual(flight_cache.stats(), dict(hits=1, misses=1, coalesced=0))
+
+        request = self.factory.get(reverse('cache_metrics'), HTTP_AUTHORIZATION='JWT {}'.format(self.admin_token))
+        response = FlightCacheMetricsView.as_view()(request)
+        self.assertEqual(response.data['shared']['hits'], 1)
+        self.assertEqual(response.data['workers'][0]['worker'], response.data['worker']['worker'])
+        self.assertIsNotNone(response.data['worker']['hit_ratio'])
+
+    def test_retrieve_flight_non_numeric_id_not_found(self):
+        request = self.factory.get('/api/v1/flight/abc/', HTTP_AUTHORIZATION='JWT {}'.format(self.admin_token))
+        self.assertEqual(self.retrieve(request, pk='abc').status_code, 404)
+
+    def test_flight_status_invalidates_cache(self):
+        self.get_flight()
+        view = FlightViewSet.as_view(actions={'patch': 'flight_status'})
+        request = self.factory.patch(reverse('flights-flight-status', args=(self.flight.pk,)),
+                                     dict(status='DELAYED'), HTTP_AUTHORIZATION='JWT {}'.format(self.admin_token))
+        view(request, pk=self.flight.pk)
+
+        self.assertEqual(self.get_flight().data['status'], 'DELAYED')
+
+    def test_taking_a_seat_invalidates_cache(self):
+        self.get_flight()
+        Flight.objects.take_seat(self.flight.pk)
+        self.assertEqual(self.get_flight().data['seats_remaining'], 9)
+
+    @override_settings(FLIGHT_CACHE_MAX_WAIT=2)
+    def test_concurrent_miss_waits_for_builder(self):
+        generation = cache.get(flight_cache.generation_key(flight_cache.LIST_SCOPE), 0)
+        data_key = 'flight-cache:list:{}:query'.format(generation)
+        cache.add(data_key + ':lock', 1)
+        threading.Timer(0.05, lambda: cache.set(data_key, ['built elsewhere'])).start()
+
+        def build():
+            raise AssertionError('a coalesced miss must not build the payload')
+
+        self.assertEqual(flight_cache.get_or_build(flight_cache.LIST_SCOPE, 'query', build), ['built elsewhere'])
+        self.assertEqual(flight_cache.stats()['coalesced'], 1)
+
+    def test_miss_builds_itself_when_builder_is_stuck(self):
+        generation = cache.get(flight_cache.generation_key(flight_cache.LIST_SCOPE), 0)
+        cache.add('flight-cache:list:{}:query:lock'.format(generation), 1)
+
+        started = time.monotonic()
+        self.assertEqual(flight_cache.get_or_build(flight_cache.LIST_SCOPE, 'query', lambda: ['built here']),
+                         ['built here'])
+        self.assertLess(time.monotonic() - started, 1)
+
+    def test_taking_a_seat_keeps_list_cache(self):
+        generation = cache.get(flight_cache.generation_key(flight_cache.LIST_SCOPE), 0)
+        Flight.objects.take_seat(self.flight.pk)
+        self.assertEqual(cache.get(flight_cache.generation_key(flight_cache.LIST_SCOPE), 0), generation)
+
+
+class TestConditionalGet(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        local_cache().clear()
+        self.admin = UserFactory(is_staff=True, password='1234')
+        self.user = UserFactory(password='1234')
+        self.admin_token = login_user(dict(email=self.admin.email, password='1234')).data['token']
+        self.user_token = login_user(dict(email=self.user.email, password='1234')).data['token']
+        self.factory = APIRequestFactory()
+        self.flight = FlightFactory(flight_number="KF35Z")
+        self.ticket = TicketFactory(flight=self.flight, user=self.user)
+
+    def get(self, view, url, token, **headers):
+        return view(self.factory.get(url, HTTP_AUTHORIZATION='JWT {}'.format(token), **headers))
+
+    def test_unchanged_flight_returns_not_modified(self):
+        view = FlightViewSet.as_view(actions={'get': 'retrieve'})
+        url = reverse('flights-detail', args=(self.flight.pk,))
+        request = lambda **headers: view(self.factory.get(
+            url, HTTP_AUTHORIZATION='JWT {}'.format(self.user_token), **headers), pk=str(self.flight.pk))
+
+        etag = request()['ETag']
+        with self.assertNumQueries(0):
+            response = request(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        self.flight.status = 'DELAYED'
+        self.flight.save()
+        response = request(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_ticket_revalidates_on_flight_change(self):
+        view = TicketViewSet.as_view(actions={'get': 'retrieve'})
+        url = reverse('tickets-detail', args=(self.ticket.pk,))
+        request = lambda **headers: view(self.factory.get(
+            url, HTTP_AUTHORIZATION='JWT {}'.format(self.user_token), **headers), pk=str(self.ticket.pk))
+
+        first = request()
+        with self.assertNumQueries(1):
+            response = request(HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(request(HTTP_IF_MODIFIED_SINCE=first['Last-Modified']).status_code, 304)
+
+        self.flight.status = 'DELAYED'
+        self.flight.save()
+        self.assertEqual(request(HTTP_IF_NONE_MATCH=first['ETag']).status_code, 200)
+
+    def test_ticket_validators_hidden_from_other_users(self):
+        view = TicketViewSet.as_view(actions={'get': 'retrieve'})
+        url = reverse('tickets-detail', args=(self.ticket.pk,))
+        response = view(self.factory.get(url, HTTP_AUTHORIZATION='JWT {}'.format(self.admin_token),
+                                         HTTP_IF_NONE_MATCH='*'), pk=str(self.ticket.pk))
+        self.assertEqual(response.status_code, 403)
+
+    def test_ticket_list_revalidates_on_new_ticket(self):
+        view = TicketViewSet.as_view(actions={'get': 'mine'})
+        url = reverse('tickets-mine')
+
+        etag = self.get(view, url, self.user_token)['ETag']
+        self.assertEqual(self.get(view, url, self.user_token, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        TicketFactory(flight=FlightFactory(flight_number="KF50H"), user=self.user)
+        self.assertEqual(self.get(view, url, self.user_token, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_admin_ticket_list_revalidates_on_ticket_and_flight_changes(self):
+        view = TicketViewSet.as_view(actions={'get': 'list'})
+        url = reverse('tickets-list')
+
+        first = self.get(view, url, self.admin_token)
+        with self.assertNumQueries(0):
+            response = self.get(view, url, self.admin_token, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+        TicketFactory(flight=FlightFactory(flight_number="KF50H"), user=self.admin)
+        second = self.get(view, url, self.admin_token, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(second.status_code, 200)
+
+        self.flight.status = 'DELAYED'
+        self.flight.save()
+        self.assertEqual(self.get(view, url, self.admin_token, HTTP_IF_NONE_MATCH=second['ETag']).status_code, 200)
+
+    def test_flight_list_revalidates_on_delete(self):
+        view = FlightViewSet.as_view(actions={'get': 'list'})
+        url = reverse('flights-list')
+        FlightFactory(flight_number="KF50H")
+
+        etag = self.get(view, url, self.user_token)['ETag']
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get(view, url, self.user_token, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        Flight.objects.filter(flight_number="KF50H").delete()
+        self.assertEqual(self.get(view, url, self.user_token, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class TestLocalCache(TestCase):
+
+    def test_least_recently_used_entry_evicted(self):
+        local = LocalCache(max_entries=2, ttl=30)
+        for key in ('a', 'b'):
+            local.set(1, key, key.upper(), local.generation(1))
+        local.get(1, 'a')
+        local.set(1, 'c', 'C', local.generation(1))
+
+        self.assertIsNone(local.get(1, 'b'))
+        self.assertEqual(local.get(1, 'a'), 'A')
+        self.assertEqual(local.stats()['evictions'], 1)
+
+    def test_expired_entry_is_a_miss(self):
+        local = LocalCache(max_entries=2, ttl=0)
+        local.set(1, 'a', 'A', local.generation(1))
+        self.assertIsNone(local.get(1, 'a'))
+
+    def test_invalidation_during_build_is_not_cached(self):
+        local = LocalCache(max_entries=2, ttl=30)
+        generation = local.generation(1)
+        local.invalidate('1')
+        local.set(1, 'a', 'stale', generation)
+
+        self.assertIsNone(local.get(1, 'a'))
+        self.assertEqual(local.stats()['hit_ratio'], 0)
+
+
+class TestValuesSerializer(TestCase):
+
+    def setUp(self):
+        self.flight = FlightFactory(
+            flight_number="KF35Z",
+            arrival_location="Germany",
+            departure_location="lagos",
+            departure_time="22:30",
+            arrival_time="07:05:09",
+            arrival_date="2017-11-10",
+            departure_date='2017-11-30',
+            capacity=120,
+            price=2500
+        )
+        FlightFactory(flight_number="KF36A", status=Flight.DELAYED)
+        user = UserFactory()
+        TicketFactory(status=Ticket.CONFIRMED, flight=self.flight, user=user,
+                      arrival_location="Bayelsa", departure_time="10:30")
+        TicketFactory(status=Ticket.RESERVED, flight=None, user=user)
+
+    def assertRendersIdentically(self, serializer_class, queryset):
+        reader = values_serializer(serializer_class)
+        expected = JSONRenderer().render(serializer_class(queryset, many=True).data)
+        actual = JSONRenderer().render(reader.many(reader.values(queryset)))
+        self.assertEqual(actual, expected)
+
+    def test_flight_rows_match_flight_serializer(self):
+        self.assertRendersIdentically(FlightSerializer, Flight.objects.order_by('id'))
+
+    def test_ticket_rows_match_ticket_serializer(self):
+        self.assertRendersIdentically(TicketSerializer, Ticket.objects.order_by('id'))
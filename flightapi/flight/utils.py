@@ -1,7 +1,72 @@
 import datetime
-import time
+import hashlib
+import os
+import threading
 
+from django.utils.dateparse import parse_date
 
-def convert_date_to_unix(date):
-    " Get inverse function of localtime "
-    return time.mktime(datetime.datetime.strptime(date, "%Y-%m-%d").timetuple())
+
+def parse_query_date(value):
+    " Parse an optional YYYY-MM-DD query parameter, raising ValueError when malformed "
+    if not value:
+        return None
+    parsed = parse_date(value)
+    if parsed is None:
+        raise ValueError(value)
+    return parsed
+
+
+def day_bounds(day):
+    " Get the [start, end) UTC datetimes covering a calendar day "
+    start = datetime.datetime.combine(day, datetime.time.min).replace(tzinfo=datetime.timezone.utc)
+    return start, start + datetime.timedelta(days=1)
+
+
+# Crockford base32: no I, L, O or U, so references survive being read out loud
+REFERENCE_ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+
+
+def booking_reference(ticket_id):
+    """
+    Encode a ticket id as a booking reference of at least 8 characters.
+
+    The id is shuffled through a fixed Feistel permutation, so consecutive tickets
+    get unrelated references while no two ids can ever share one. The permutation
+    must never change: references already issued are derived from it.
+    """
+    bits = 40
+    while ticket_id >= 1 << bits:
+        bits += 10
+    half = bits // 2
+    mask = (1 << half) - 1
+    left, right = ticket_id >> half, ticket_id & mask
+    for round_number in range(4):
+        digest = hashlib.sha256('{}:{}'.format(round_number, right).encode()).digest()
+        left, right = right, left ^ (int.from_bytes(digest[:8], 'big') & mask)
+    permuted = (left << half) | right
+
+    characters = []
+    for _ in range(bits // 5):
+        permuted, index = divmod(permuted, 32)
+        characters.append(REFERENCE_ALPHABET[index])
+    return ''.join(reversed(characters))
+
+
+class PerProcess(object):
+    """
+    Build one object per process on first use. A forked worker inherits the
+    parent's object but none of the threads it started, so it builds its own.
+    """
+
+    def __init__(self, build):
+        self.build = build
+        self.lock = threading.Lock()
+        self.value = None
+        self.pid = None
+
+    def get(self):
+        with self.lock:
+            if self.value is None or self.pid != os.getpid():
+                self.value = self.build()
+                self.pid = os.getpid()
+            return self.value
@@ -0,0 +1,21 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class FastPaceCursorPagination(CursorPagination):
+    """
+    Keyset pagination on the primary key, so every page is a single index
+    range scan no matter how deep the client has paged.
+    """
+    ordering = 'id'
+    page_size = settings.REST_FRAMEWORK['PAGE_SIZE']
+    page_size_query_param = 'page_size'
+    max_page_size = settings.MAX_PAGE_SIZE
+
+
+class FlightSearchCursorPagination(FastPaceCursorPagination):
+    """
+    Search results in departure order. The cursor keys on the departure date and
+    steps over flights sharing it by offset.
+    """
+    ordering = ('departure_date', 'departure_time', 'id')
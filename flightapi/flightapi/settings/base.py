@@ -96,23 +96,107 @@ EMAIL_HOST_USER = os.getenv('SENDGRID_USERNAME')
 EMAIL_HOST_PASSWORD = os.getenv('SENDGRID_PASSWORD')
 EMAIL_PORT = 587
 EMAIL_USE_TLS = True
-AIRTECH_MAIL = os.getenv('FASTPACE_EMAIL')
+FASTPACE_EMAIL = os.getenv('FASTPACE_EMAIL')
 
 #CELERY SETTINGS
 BROKER_URL = 'redis://localhost:6379'
 CELERY_RESULT_BACKEND = 'redis://localhost:6379'
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': os.getenv('CACHE_REDIS_URL', 'redis://localhost:6379/1'),
+        'OPTIONS': {
+            'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+        },
+    }
+}
+
+# Serialized flight list/detail payloads: lifetime, how long the build lock is
+# held at most, and how long a miss waits on another request building the same
+# payload before building it itself (seconds). Seat sales only refresh the
+# flight's detail payload, so list pages show seat counts up to FLIGHT_CACHE_TTL old.
+FLIGHT_CACHE_TTL = 300
+FLIGHT_CACHE_LOCK_TIMEOUT = 5
+FLIGHT_CACHE_MAX_WAIT = 0.1
+FLIGHT_CACHE_POLL_INTERVAL = 0.02
+
+# Per-worker LRU in front of the shared cache: entries, lifetime (seconds), and how
+# often each worker publishes its hit ratio for /cache-metrics/ (seconds)
+FLIGHT_LOCAL_CACHE_SIZE = 1000
+FLIGHT_LOCAL_CACHE_TTL = 30
+FLIGHT_CACHE_STATS_INTERVAL = 5
 CELERY_ACCEPT_CONTENT = ['application/json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'Africa/Lagos'
-CELERY_BEAT_SCHEDULE = {
+# Celery 3.1 reads the beat schedule from CELERYBEAT_SCHEDULE, not CELERY_BEAT_SCHEDULE
+CELERYBEAT_SCHEDULE = {
     'send-email-reminder': {
         'task': 'flight.tasks.send_reminder_to_travellers',
         'schedule': crontab(hour=1, minute=0)
+    },
+    'publish-ticket-events': {
+        'task': 'flight.tasks.publish_ticket_events',
+        'schedule': timedelta(seconds=30)
+    },
+    'send-queued-mail': {
+        'task': 'flight.tasks.send_queued_mail',
+        'schedule': crontab()
+    },
+    'purge-dead-mail': {
+        'task': 'flight.tasks.purge_dead_mail',
+        'schedule': crontab(hour=2, minute=45)
+    },
+    'purge-idempotency-keys': {
+        'task': 'flight.tasks.purge_expired_idempotency_keys',
+        'schedule': crontab(hour=2, minute=0)
+    },
+    'generate-scheduled-flights': {
+        'task': 'flight.tasks.generate_scheduled_flights',
+        'schedule': crontab(hour=3, minute=0)
+    },
+    'purge-ticket-events': {
+        'task': 'flight.tasks.purge_published_ticket_events',
+        'schedule': crontab(hour=2, minute=15)
+    },
+    'purge-refresh-tokens': {
+        'task': 'portfolio.tasks.purge_expired_refresh_tokens',
+        'schedule': crontab(hour=2, minute=30)
     }
 }
 CELERY_ALWAYS_EAGER = True
 
+# How notification work leaves the request: 'celery' or 'thread'.
+# None picks 'thread' while CELERY_ALWAYS_EAGER is set and 'celery' otherwise.
+NOTIFICATION_DISPATCH = None
+
+# How many days ahead scheduled flights are generated, and rows per insert
+FLIGHT_SCHEDULE_HORIZON_DAYS = 90
+FLIGHT_SCHEDULE_BATCH_SIZE = 1000
+
+# Most flights POST /flight/bulk/ accepts in one request
+FLIGHT_BULK_CREATE_MAX_ROWS = 1000
+
+# Most ticket ids GET /ticket/batch/ accepts in one request
+TICKET_BATCH_MAX_IDS = 50
+
+# Number of tickets handed to each reminder subtask
+REMINDER_CHUNK_SIZE = 500
+
+# Queued emails sent per SMTP connection, attempts before a message is left for
+# inspection, how long a worker's claim on a batch lasts before another takes it
+# over, and how long messages that ran out of attempts are kept before purging
+MAIL_BATCH_SIZE = 100
+MAIL_MAX_ATTEMPTS = 5
+MAIL_CLAIM_TIMEOUT = timedelta(minutes=10)
+MAIL_DEAD_RETENTION = timedelta(days=7)
+
+# Ticket notification outbox rows relayed to Celery per transaction, and how
+# long published rows are kept to absorb redeliveries
+OUTBOX_BATCH_SIZE = 500
+OUTBOX_RETENTION = timedelta(days=7)
+
 
 REST_FRAMEWORK = {
     # Use Django's standard `django.contrib.auth` permissions,
@@ -121,11 +205,19 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.IsAuthenticatedOrReadOnly',
     ),
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_jwt.authentication.JSONWebTokenAuthentication',
+        'portfolio.authentication.CachedJSONWebTokenAuthentication',
     ),
     'TEST_REQUEST_DEFAULT_FORMAT': 'json',
+    'DEFAULT_PAGINATION_CLASS': 'flightapi.pagination.FastPaceCursorPagination',
+    'PAGE_SIZE': 50,
 }
 
+# Upper bound for the ?page_size= query parameter on paginated listings
+MAX_PAGE_SIZE = 200
+
+# How long a stored response is replayed for a repeated Idempotency-Key
+IDEMPOTENCY_KEY_TTL = timedelta(hours=24)
+
 # Authentication backends
 AUTHENTICATION_BACKENDS = (
     'django.contrib.auth.backends.ModelBackend', # default
@@ -160,12 +252,16 @@ JWT_AUTH = {
     'JWT_ALLOW_REFRESH': False,
     'JWT_AUTH_HEADER_PREFIX': 'JWT',
     'JWT_AUTH_COOKIE': 'Authorization',
-    'JWT_EXPIRATION_DELTA': timedelta(seconds=86400),
+    # Access tokens are short-lived; clients renew them at /token/refresh/
+    'JWT_EXPIRATION_DELTA': timedelta(minutes=15),
     'JWT_REFRESH_EXPIRATION_DELTA': timedelta(days=7)
 }
 
 AUTH_USER_MODEL = 'portfolio.User'
 
+# Seconds a JWT-authenticated user snapshot is served from cache
+AUTH_USER_CACHE_TTL = 300
+
 # Internationalization
 # https://docs.djangoproject.com/en/1.11/topics/i18n/
 
@@ -188,6 +284,12 @@ STATIC_ROOT = os.path.join(BASE_DIR, STATIC_URL.strip("/"))
 MEDIA_URL = STATIC_URL + "media/"
 MEDIA_ROOT = os.path.join(BASE_DIR, *MEDIA_URL.strip("/").split("/"))
 
+# Profile photo thumbnails generated after upload: (label, (width, height))
+PROFILE_THUMBNAIL_SIZES = (
+    ('small', (64, 64)),
+    ('medium', (256, 256)),
+)
+
 STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 
 # Configure Django App for Heroku.
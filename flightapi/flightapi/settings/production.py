@@ -16,4 +16,11 @@ DATABASES['default'] = config(
     default=os.getenv('DATABASE_URL'), conn_max_age=600, ssl_require=True
 )
 
-SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
\ No newline at end of file
+SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
+
+# Notifications are consumed by the Procfile worker rather than run in the web process
+BROKER_URL = os.getenv('REDIS_URL', BROKER_URL)
+CELERY_RESULT_BACKEND = BROKER_URL
+CELERY_ALWAYS_EAGER = False
+# The read cache shares the Heroku Redis instance with the broker
+CACHES['default']['LOCATION'] = os.getenv('CACHE_REDIS_URL', BROKER_URL)
@@ -17,18 +17,25 @@ from django.conf.urls import url, include
 from django.contrib import admin
 from rest_framework.routers import DefaultRouter
 
-from portfolio.api.views import FastPaceUserSignup, FastPaceUserLogin, FastPaceUserViewSet
-from flight.api.views import FlightViewSet, TicketViewSet
+from portfolio.api.views import (FastPaceTokenRefresh, FastPaceTokenRevoke, FastPaceUserLogin, FastPaceUserSignup,
+                                 FastPaceUserViewSet)
+from flight.api.views import (DispatchMetricsView, FlightCacheMetricsView, FlightScheduleViewSet, FlightViewSet,
+                              TicketViewSet)
 
 router = DefaultRouter()
 router.register(r'user', FastPaceUserViewSet, base_name='users')
 router.register(r'ticket', TicketViewSet, base_name='tickets')
 router.register(r'flight', FlightViewSet, base_name='flights')
+router.register(r'flight-schedule', FlightScheduleViewSet, base_name='flight_schedules')
 
 api_v1 = [
     url(r'^', include(router.urls)),
     url(r'^signup/$', FastPaceUserSignup.as_view(), name="sign_up"),
     url(r'^login/$', FastPaceUserLogin.as_view(), name="login"),
+    url(r'^token/refresh/$', FastPaceTokenRefresh.as_view(), name="token_refresh"),
+    url(r'^token/revoke/$', FastPaceTokenRevoke.as_view(), name="token_revoke"),
+    url(r'^dispatch-metrics/$', DispatchMetricsView.as_view(), name="dispatch_metrics"),
+    url(r'^cache-metrics/$', FlightCacheMetricsView.as_view(), name="cache_metrics"),
     url(r'^api-auth/', include('rest_framework.urls')),
 ]
 
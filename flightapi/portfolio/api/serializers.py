@@ -1,3 +1,4 @@
+from django.conf import settings
 from portfolio.models import User
 from rest_framework import serializers
 
@@ -15,21 +16,25 @@ class CreateFastPaceUserSerializer(serializers.ModelSerializer):
         fields = ('id', 'first_name', 'last_name', 'email', 'password')
 
     def create(self, validated_data):
-        password = validated_data.get('password')
-        user = User.objects.create(**validated_data)
-        user.set_password(password)
-        user.save()
-        return user
+        return User.objects.create_user(**validated_data)
 
 class FastPaceLoginSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ('id', 'first_name', 'last_name', 'email')
 
-class JSONWebTokenSerializer(serializers.Serializer):
-    token = serializers.CharField(max_length=1024)
-
 class FileUploadSerializer(serializers.ModelSerializer):
+    thumbnails = serializers.SerializerMethodField()
+
     class Meta:
         model = User
-        fields = ('id', 'profile_photo')
+        fields = ('id', 'profile_photo', 'thumbnails')
+
+    def get_thumbnails(self, user):
+        """
+        Thumbnail URLs by size label, or None while they are still being generated.
+        """
+        if not (user.profile_photo and user.photo_thumbnails_ready):
+            return None
+        storage = user.profile_photo.storage
+        return {label: storage.url(user.thumbnail_name(label)) for label, _ in settings.PROFILE_THUMBNAIL_SIZES}
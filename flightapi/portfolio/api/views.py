@@ -1,10 +1,15 @@
 from portfolio.api.serializers import (CreateFastPaceUserSerializer,
                                      FastPaceLoginSerializer,
                                      FastPaceUserSerializer,
-                                     FileUploadSerializer,
-                                     JSONWebTokenSerializer)
-from portfolio.models import User, get_user
+                                     FileUploadSerializer)
+from portfolio.manager import RefreshTokenError
+from portfolio.models import RefreshToken, User
+from portfolio.tasks import generate_profile_thumbnails
 from django.contrib.auth import authenticate
+from django.core.files.uploadedfile import UploadedFile
+from django.db import transaction
+from flight.dispatch import dispatch
+from flightapi.pagination import FastPaceCursorPagination
 from django.shortcuts import get_object_or_404
 from rest_framework import exceptions, status, viewsets
 from rest_framework.decorators import action
@@ -17,6 +22,20 @@ from rest_framework_jwt.settings import api_settings
 jwt_payload_handler = api_settings.JWT_PAYLOAD_HANDLER
 jwt_encode_handler = api_settings.JWT_ENCODE_HANDLER
 
+# Shorter terms produce no trigrams, so the substring index could not be used
+MIN_SEARCH_LENGTH = 3
+
+
+def token_response(user):
+    """
+    Build the signup/login response, encoding the JWT from the user already in hand
+    and starting a new refresh token family.
+    """
+    response = dict(FastPaceLoginSerializer(user).data)
+    response['token'] = jwt_encode_handler(jwt_payload_handler(user))
+    response['refresh_token'] = RefreshToken.objects.issue(user)
+    return response
+
 
 class FastPaceUserSignup(APIView):
     permission_classes = (AllowAny,)
@@ -28,21 +47,8 @@ class FastPaceUserSignup(APIView):
         if email and password and first_name:
             serializer = CreateFastPaceUserSerializer(data=request.data)
             if serializer.is_valid():
-                serializer.save()
-                token_serializer = JSONWebTokenSerializer(data={
-                    "token": jwt_encode_handler(
-                        jwt_payload_handler(get_user(serializer.data.get('id')))
-                    )
-                })
-                if token_serializer.is_valid():
-                    response = {
-                        'token': token_serializer.data.get('token'),
-                        'id': serializer.data.get('id'),
-                        'first_name': serializer.data.get('first_name'),
-                        'last_name': serializer.data.get('last_name'),
-                        'email': serializer.data.get('email')
-                    }
-                    return Response(response, status=status.HTTP_201_CREATED)
+                user = serializer.save()
+                return Response(token_response(user), status=status.HTTP_201_CREATED)
         return Response(dict(message="email, password and firstname are required"), status=400)
 
 
@@ -61,34 +67,82 @@ class FastPaceUserLogin(APIView):
     def post(self, request):
         authenticated_user = self.validate_email_password(request, request.data)
         if authenticated_user:
-            serializer = FastPaceLoginSerializer(authenticated_user)
-            token_serializer = JSONWebTokenSerializer(data={
-                "token": jwt_encode_handler(
-                    jwt_payload_handler(get_user(serializer.data.get('id')))
-                )
-            })
-            if token_serializer.is_valid():
-                response = {
-                    'token': token_serializer.data.get('token'),
-                    'id': serializer.data.get('id'),
-                    'first_name': serializer.data.get('first_name'),
-                    'last_name': serializer.data.get('last_name'),
-                    'email': serializer.data.get('email')
-                }
-                return Response(response, status=status.HTTP_200_OK)
+            return Response(token_response(authenticated_user), status=status.HTTP_200_OK)
         response = dict(message="Invalid request")
         return Response(response, status=400)
 
 
+class FastPaceTokenRefresh(APIView):
+    """
+    Exchange a refresh token for a new access token and a rotated refresh token.
+    The access token is usually expired by now, so no authentication is attempted.
+    """
+    authentication_classes = ()
+    permission_classes = (AllowAny,)
+
+    def post(self, request):
+        refresh_token = request.data.get('refresh_token')
+        if not refresh_token:
+            return Response(dict(message="refresh_token is required"), status=status.HTTP_400_BAD_REQUEST)
+        try:
+            user, rotated_token = RefreshToken.objects.rotate(refresh_token)
+        except RefreshTokenError as error:
+            return Response(dict(message=str(error)), status=status.HTTP_401_UNAUTHORIZED)
+        response = dict(
+            token=jwt_encode_handler(jwt_payload_handler(user)),
+            refresh_token=rotated_token
+        )
+        return Response(response, status=status.HTTP_200_OK)
+
+
+class FastPaceTokenRevoke(APIView):
+    """
+    Log out by revoking every refresh token issued from the same login.
+    """
+    authentication_classes = ()
+    permission_classes = (AllowAny,)
+
+    def post(self, request):
+        refresh_token = request.data.get('refresh_token')
+        if not refresh_token:
+            return Response(dict(message="refresh_token is required"), status=status.HTTP_400_BAD_REQUEST)
+        RefreshToken.objects.revoke(refresh_token)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
 class FastPaceUserViewSet(viewsets.ViewSet):
+    pagination_class = FastPaceCursorPagination
+
     def list(self, request):
-        print(request.user)
         if not request.user.is_staff:
             response = dict(message='You are not authorized to view this information')
             return Response(response, status=status.HTTP_401_UNAUTHORIZED)
         queryset = User.objects.all()
-        serializer = FastPaceUserSerializer(queryset, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(queryset, request, view=self)
+        serializer = FastPaceUserSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """
+        Find users by name or email. ?match=substring searches anywhere in the field
+        instead of at its start.
+        """
+        if not request.user.is_staff:
+            response = dict(message='You are not authorized to view this information')
+            return Response(response, status=status.HTTP_401_UNAUTHORIZED)
+
+        term = request.query_params.get('q', '').strip()
+        if len(term) < MIN_SEARCH_LENGTH:
+            response = dict(message='q must be at least {} characters'.format(MIN_SEARCH_LENGTH))
+            return Response(response, status=status.HTTP_400_BAD_REQUEST)
+
+        queryset = User.objects.search(term, substring=request.query_params.get('match') == 'substring')
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(queryset, request, view=self)
+        serializer = FastPaceUserSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
 
     def retrieve(self, request, pk=None):
         queryset = User.objects.all()
@@ -118,19 +172,37 @@ class FastPaceUserViewSet(viewsets.ViewSet):
 
     @action(detail=False, methods=['put'])
     def upload(self, request):
+        """
+        Store the photo and hand thumbnail generation off the request.
+        """
         try:
             file = request.data['file']
         except KeyError:
-            return ParseError('No file attached')
+            raise ParseError('No file attached')
         user = request.user
-        user.profile_photo = file
-        user.save()
+        if user.profile_photo:
+            user.delete_thumbnails()
+        if isinstance(file, UploadedFile):
+            # FieldFile.save streams the upload to storage chunk by chunk.
+            user.profile_photo.save(file.name, file, save=False)
+        else:
+            user.profile_photo = file
+        user.photo_thumbnails_ready = False
+        user.save(update_fields=['profile_photo', 'photo_thumbnails_ready'])
+
+        if isinstance(file, UploadedFile):
+            photo_name = user.profile_photo.name
+            transaction.on_commit(lambda: dispatch(generate_profile_thumbnails, user.pk, photo_name))
         serializer = FileUploadSerializer(user)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
     @action(detail=False, methods=['delete'])
     def delete_photo(self, request):
         user = request.user
-        user.profile_photo.delete(save=True)
+        if user.profile_photo:
+            user.delete_thumbnails()
+        user.photo_thumbnails_ready = False
+        user.profile_photo.delete(save=False)
+        user.save(update_fields=['profile_photo', 'photo_thumbnails_ready'])
         response = dict(message="Profile photo deleted successfully")
         return Response(response, status=status.HTTP_204_NO_CONTENT)
@@ -0,0 +1,43 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.translation import ugettext as _
+from portfolio.models import User, user_cache_key
+from rest_framework import exceptions
+from rest_framework_jwt.authentication import JSONWebTokenAuthentication, jwt_get_username_from_payload
+
+SNAPSHOT_FIELDS = ('id', 'email', 'is_staff', 'is_active')
+
+
+class CachedJSONWebTokenAuthentication(JSONWebTokenAuthentication):
+    """
+    JWT authentication that resolves the user from a cached snapshot of the
+    fields authentication and permissions need, instead of querying every request.
+
+    The user is rebuilt with every other field deferred, so reading or saving
+    those fields still goes to the database for just that field.
+    """
+
+    def authenticate_credentials(self, payload):
+        username = jwt_get_username_from_payload(payload)
+        user_id = payload.get('user_id')
+        if not username or not user_id:
+            msg = _('Invalid payload.')
+            raise exceptions.AuthenticationFailed(msg)
+
+        key = user_cache_key(user_id)
+        snapshot = cache.get(key)
+        if snapshot is None:
+            snapshot = User.objects.filter(pk=user_id).values_list(*SNAPSHOT_FIELDS).first()
+            if snapshot is not None:
+                cache.set(key, snapshot, settings.AUTH_USER_CACHE_TTL)
+
+        if snapshot is None or snapshot[1] != username:
+            msg = _('Invalid signature.')
+            raise exceptions.AuthenticationFailed(msg)
+
+        user = User.from_db(DEFAULT_DB_ALIAS, SNAPSHOT_FIELDS, snapshot)
+        if not user.is_active:
+            msg = _('User account is disabled.')
+            raise exceptions.AuthenticationFailed(msg)
+        return user
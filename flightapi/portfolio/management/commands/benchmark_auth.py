@@ -0,0 +1,50 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from portfolio.api.views import FastPaceUserLogin, FastPaceUserSignup
+from rest_framework.test import APIRequestFactory
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Measure signup and login throughput and queries per request'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200,
+                            help='Number of signups and logins to run')
+
+    def handle(self, *args, **options):
+        factory = APIRequestFactory()
+        emails = ['benchmark{}@fastpace.com'.format(number) for number in range(options['requests'])]
+        try:
+            with transaction.atomic():
+                self.measure('signup', FastPaceUserSignup.as_view(), 201, [
+                    factory.post(reverse('sign_up'), dict(email=email, password='1234', first_name='bench'),
+                                 format='json') for email in emails
+                ])
+                self.measure('login', FastPaceUserLogin.as_view(), 200, [
+                    factory.post(reverse('login'), dict(email=email, password='1234'), format='json')
+                    for email in emails
+                ])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def measure(self, name, view, expected_status, requests):
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            for request in requests:
+                response = view(request)
+                if response.status_code != expected_status:
+                    raise AssertionError('{} returned {}'.format(name, response.status_code))
+            seconds = time.perf_counter() - started
+
+        self.stdout.write('{}: {:.1f} requests/s, {:.1f} queries per request'.format(
+            name, len(requests) / seconds, len(queries) / len(requests)
+        ))
@@ -1,9 +1,33 @@
+import hashlib
+import secrets
+from datetime import datetime, timezone
+
 from django.contrib.auth.models import UserManager
+from django.db import models
+from django.db.models import Q
+from django.db.models.functions import Lower
+from rest_framework_jwt.settings import api_settings
 
 
 class FastPaceUserManager(UserManager):
     use_in_migrations = True
 
+    SEARCH_FIELDS = ('first_name', 'last_name', 'email')
+
+    def search(self, term, substring=False):
+        """
+        Users whose first name, last name or email starts with (or, with substring,
+        contains) the term, case-insensitively. Each field is matched as lower(field),
+        the expression the portfolio_user search indexes are built on.
+        """
+        term = term.lower()
+        lookup = 'contains' if substring else 'startswith'
+        annotations = {'{}_lower'.format(field): Lower(field) for field in self.SEARCH_FIELDS}
+        condition = Q()
+        for field in self.SEARCH_FIELDS:
+            condition |= Q(**{'{}_lower__{}'.format(field, lookup): term})
+        return self.annotate(**annotations).filter(condition)
+
     def _create_user(self, email, password, **extra_fields):
         """
         create and save a user with a email, and password.
@@ -31,3 +55,63 @@ class FastPaceUserManager(UserManager):
             raise ValueError('superuser must have is_superuser set to True.')
 
         return self._create_user(email, password, **extra_fields)
+
+
+class RefreshTokenError(Exception):
+    pass
+
+
+class RefreshTokenManager(models.Manager):
+
+    @staticmethod
+    def digest(token):
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def issue(self, user, family=None):
+        """
+        Create a refresh token for the user and return its opaque value.
+        Only the digest is stored.
+        """
+        token = secrets.token_urlsafe(32)
+        extra_fields = dict(family=family) if family else {}
+        self.create(
+            user=user,
+            token_hash=self.digest(token),
+            expires_at=datetime.now(tz=timezone.utc) + api_settings.JWT_REFRESH_EXPIRATION_DELTA,
+            **extra_fields
+        )
+        return token
+
+    def rotate(self, token):
+        """
+        Revoke the presented token and return (user, new token) in the same family.
+
+        The revoke is a conditional UPDATE, so of two concurrent refreshes with the
+        same token only one wins. A token that is already revoked has been replayed,
+        and the whole family is revoked with it.
+        """
+        now = datetime.now(tz=timezone.utc)
+        try:
+            record = self.select_related('user').get(token_hash=self.digest(token))
+        except self.model.DoesNotExist:
+            raise RefreshTokenError('Invalid refresh token')
+
+        if record.expires_at <= now or not record.user.is_active:
+            raise RefreshTokenError('Refresh token has expired')
+
+        claimed = self.filter(pk=record.pk, revoked_at__isnull=True).update(revoked_at=now)
+        if not claimed:
+            self.revoke_family(record.family)
+            raise RefreshTokenError('Refresh token has been revoked')
+        return record.user, self.issue(record.user, family=record.family)
+
+    def revoke(self, token):
+        """
+        Revoke every token issued from the same login as this one.
+        """
+        family = self.filter(token_hash=self.digest(token)).values_list('family', flat=True).first()
+        if family is not None:
+            self.revoke_family(family)
+
+    def revoke_family(self, family):
+        self.filter(family=family, revoked_at__isnull=True).update(revoked_at=datetime.now(tz=timezone.utc))
@@ -0,0 +1,23 @@
+# Generated by Django 2.1.3 on 2026-10-18 11:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portfolio', '0003_refreshtoken'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='photo_thumbnails_ready',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='profile_photo',
+            field=models.ImageField(blank=True, null=True, upload_to='portfolio_photos/'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+SEARCH_INDEXES = (
+    # Case-insensitive email lookups and prefix searches (User.save stores emails lowercased)
+    ('portfolio_user_email_lower_idx', 'btree (lower(email) text_pattern_ops)'),
+    ('portfolio_user_first_name_trgm_idx', 'gin (lower(first_name) gin_trgm_ops)'),
+    ('portfolio_user_last_name_trgm_idx', 'gin (lower(last_name) gin_trgm_ops)'),
+    ('portfolio_user_email_trgm_idx', 'gin (lower(email) gin_trgm_ops)'),
+)
+
+
+def create_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, definition in SEARCH_INDEXES:
+        schema_editor.execute('CREATE INDEX {} ON portfolio_user USING {}'.format(name, definition))
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, _ in SEARCH_INDEXES:
+        schema_editor.execute('DROP INDEX IF EXISTS {}'.format(name))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portfolio', '0004_profile_photo_thumbnails'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
@@ -1,6 +1,11 @@
+import posixpath
+import uuid
+
+from django.conf import settings
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin
-from django.db import models
-from portfolio.manager import FastPaceUserManager
+from django.core.cache import cache
+from django.db import models, transaction
+from portfolio.manager import FastPaceUserManager, RefreshTokenManager
 
 # Create your models here.
 
@@ -9,7 +14,8 @@ class User(AbstractBaseUser, PermissionsMixin):
     first_name = models.CharField(max_length=80, blank=True, null=True)
     last_name = models.CharField(max_length=80, blank=True, null=True)
     email = models.EmailField(blank=True, unique=True, null=True)
-    profile_photo = models.ImageField(upload_to='../flightapi/portfolio_photos/', blank=True, null=True)
+    profile_photo = models.ImageField(upload_to='portfolio_photos/', blank=True, null=True)
+    photo_thumbnails_ready = models.BooleanField(default=False)
     is_staff = models.BooleanField(default=False)
     is_active = models.BooleanField(default=True)
 
@@ -22,7 +28,36 @@ class User(AbstractBaseUser, PermissionsMixin):
         if self.email:
             self.email = self.email.lower().strip()
 
+        adding = self._state.adding
         super(User, self).save(*args, **kwargs);
+        # A brand new user has no cached snapshot to forget.
+        if not adding:
+            self.forget_cached_snapshot()
+
+    def delete(self, *args, **kwargs):
+        self.forget_cached_snapshot()
+        return super(User, self).delete(*args, **kwargs)
+
+    def forget_cached_snapshot(self):
+        """
+        Drop the cached authentication snapshot now, and again once the
+        transaction commits so a concurrent request cannot re-cache stale fields.
+        """
+        key = user_cache_key(self.pk)
+        cache.delete(key)
+        transaction.on_commit(lambda: cache.delete(key))
+
+    def thumbnail_name(self, label):
+        """
+        Storage name of the thumbnail of the current profile photo for a size label.
+        """
+        directory, filename = posixpath.split(self.profile_photo.name)
+        return posixpath.join(directory, 'thumbnails', label, posixpath.splitext(filename)[0] + '.jpg')
+
+    def delete_thumbnails(self):
+        storage = self.profile_photo.storage
+        for label, _ in settings.PROFILE_THUMBNAIL_SIZES:
+            storage.delete(self.thumbnail_name(label))
 
     @property
     def is_admin(self):
@@ -31,6 +66,25 @@ class User(AbstractBaseUser, PermissionsMixin):
         """
         return "{} is an admin".format(self.is_staff)
 
+class RefreshToken(models.Model):
+    """
+    A single-use refresh token, stored as a SHA-256 digest of the opaque value.
+    Every token issued from one login shares a family, so presenting a rotated
+    (revoked) token revokes the whole family.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    token_hash = models.CharField(max_length=64, unique=True)
+    family = models.UUIDField(default=uuid.uuid4, db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+    revoked_at = models.DateTimeField(blank=True, null=True)
+
+    objects = RefreshTokenManager()
+
+
+def user_cache_key(pk):
+    return 'auth-user:{}'.format(pk)
+
 def get_user(pk):
     try:
         user = User.objects.get(pk=pk)
@@ -0,0 +1,45 @@
+from __future__ import absolute_import, unicode_literals
+
+import io
+import logging
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from flightapi.celeryapp import app
+from PIL import Image, ImageOps
+from portfolio.models import RefreshToken, User
+
+logger = logging.getLogger(__name__)
+
+
+@app.task
+def purge_expired_refresh_tokens():
+    RefreshToken.objects.filter(expires_at__lte=datetime.now(tz=timezone.utc)).delete()
+
+
+@app.task
+def generate_profile_thumbnails(user_id, photo_name):
+    """
+    Render every PROFILE_THUMBNAIL_SIZES thumbnail of an uploaded profile photo.
+    Thumbnails are only marked ready if the user has not uploaded another photo since.
+    """
+    user = User(pk=user_id, profile_photo=photo_name)
+    storage = user.profile_photo.storage
+    try:
+        with storage.open(photo_name) as photo:
+            image = Image.open(photo)
+            image.load()
+    except OSError:
+        logger.exception('Could not read profile photo %s', photo_name)
+        return
+
+    image = image.convert('RGB')
+    for label, size in settings.PROFILE_THUMBNAIL_SIZES:
+        buffer = io.BytesIO()
+        ImageOps.fit(image, size, Image.LANCZOS).save(buffer, 'JPEG', quality=85)
+        name = user.thumbnail_name(label)
+        storage.delete(name)
+        storage.save(name, ContentFile(buffer.getvalue()))
+
+    User.objects.filter(pk=user_id, profile_photo=photo_name).update(photo_thumbnails_ready=True)
@@ -1,12 +1,22 @@
+import io
 import json
 import os
+import shutil
+import tempfile
+from datetime import datetime, timedelta, timezone
 
-from django.test import TestCase, Client
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, Client, override_settings
 from django.urls import reverse
+from PIL import Image
 from rest_framework.test import APITestCase, APIRequestFactory
 
+from flightapi.celeryapp import app as celery_app
+from portfolio.api.serializers import FileUploadSerializer
 from portfolio.api.views import FastPaceUserViewSet
-from portfolio.models import User
+from portfolio.models import RefreshToken, User
+from portfolio.tasks import generate_profile_thumbnails
 from portfolio.tests.factories import login_user, UserFactory
 
 client = Client()
@@ -36,6 +46,17 @@ class TestUserSignup(TestCase):
         self.assertEqual(User.objects.count(), 1)
         self.assertEqual(User.objects.get().email, 'sola.smith@gmail.com')
 
+    def test_signup_inserts_user_once(self):
+        url = reverse('sign_up')
+        with self.assertNumQueries(3):
+            response = client.post(url,
+                                   data=json.dumps(self.user_payload),
+                                   content_type='application/json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(response.data['token'])
+        self.assertTrue(User.objects.get().check_password('1234'))
+
     def test_unsuccessful_signup(self):
         url = reverse('sign_up')
         response = client.post(url, data=json.dumps(self.invalid_payload),
@@ -65,6 +86,17 @@ class TestUserLogin(APITestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.data['email'], 'sola.smith@yahoo.com')
 
+    def test_login_fetches_user_once(self):
+        login_payload = dict(
+            email=self.user.email,
+            password='1234'
+        )
+        with self.assertNumQueries(2):
+            response = self.client.post(self.url, data=login_payload, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['id'], self.user.pk)
+        self.assertTrue(response.data['token'])
+
     def test_unsuccessful_login(self):
         invalid_payload = {
             'email': 'charles@y.com',
@@ -75,6 +107,55 @@ class TestUserLogin(APITestCase):
         self.assertEqual(response.status_code, 400)
         self.assertEqual(response.data['message'], 'Invalid request')
 
+class TestTokenRefresh(APITestCase):
+    def setUp(self):
+        self.user = UserFactory(email='sola.smith@yahoo.com', password='1234')
+        self.refresh_token = login_user(dict(email=self.user.email, password='1234')).data['refresh_token']
+        self.url = reverse('token_refresh')
+
+    def refresh(self, refresh_token):
+        return self.client.post(self.url, data=dict(refresh_token=refresh_token), format='json')
+
+    def test_refresh_rotates_token(self):
+        response = self.refresh(self.refresh_token)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.data['refresh_token'], self.refresh_token)
+
+        detail = self.client.get(reverse('users-detail', args=(self.user.pk,)),
+                                 HTTP_AUTHORIZATION='JWT {}'.format(response.data['token']))
+        self.assertEqual(detail.status_code, 200)
+
+    def test_reused_refresh_token_revokes_family(self):
+        rotated_token = self.refresh(self.refresh_token).data['refresh_token']
+
+        response = self.refresh(self.refresh_token)
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.data['message'], 'Refresh token has been revoked')
+        self.assertEqual(self.refresh(rotated_token).status_code, 401)
+
+    def test_revoked_refresh_token_rejected(self):
+        response = self.client.post(reverse('token_revoke'), data=dict(refresh_token=self.refresh_token),
+                                    format='json')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.refresh(self.refresh_token).status_code, 401)
+
+    def test_expired_refresh_token_rejected(self):
+        RefreshToken.objects.update(expires_at=datetime.now(tz=timezone.utc) - timedelta(seconds=1))
+        response = self.refresh(self.refresh_token)
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.data['message'], 'Refresh token has expired')
+
+    def test_refresh_ignores_expired_access_token(self):
+        response = self.client.post(self.url, data=dict(refresh_token=self.refresh_token), format='json',
+                                    HTTP_AUTHORIZATION='JWT expired.token.value')
+        self.assertEqual(response.status_code, 200)
+
+    def test_refresh_token_purge_scheduled(self):
+        entry = celery_app.conf.CELERYBEAT_SCHEDULE['purge-refresh-tokens']
+        self.assertEqual(entry['task'], 'portfolio.tasks.purge_expired_refresh_tokens')
+        self.assertIn(entry['task'], celery_app.tasks)
+
+
 class TestFastPaceUser(APITestCase):
 
     def setUp(self):
@@ -117,8 +198,8 @@ class TestFastPaceUser(APITestCase):
             self.admin.data['token']))
         response = view(request)
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(response.data[0]['first_name'], 'segun')
-        self.assertEqual(response.data[0]['email'], 'segun@gmail.com')
+        self.assertEqual(response.data['results'][0]['first_name'], 'segun')
+        self.assertEqual(response.data['results'][0]['email'], 'segun@gmail.com')
 
     def test_list_non_admin(self):
         url = reverse('users-list')
@@ -133,6 +214,38 @@ class TestFastPaceUser(APITestCase):
         self.assertEqual(response.status_code, 401)
         self.assertEqual(response.data['message'], 'You are not authorized to view this information')
 
+    def search(self, token, **params):
+        view = FastPaceUserViewSet.as_view(
+            actions={
+                'get': 'search',
+            }
+        )
+        request = self.factory.get(reverse('users-search'), params, HTTP_AUTHORIZATION='JWT {}'.format(token))
+        return view(request)
+
+    def test_search_users_by_prefix(self):
+        response = self.search(self.admin.data['token'], q='KUN')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([user['email'] for user in response.data['results']], ['kunle@gmail.com'])
+
+        response = self.search(self.admin.data['token'], q='gma')
+        self.assertEqual(response.data['results'], [])
+
+    def test_search_users_by_substring(self):
+        response = self.search(self.admin.data['token'], q='gmail', match='substring', page_size=2)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertIsNotNone(response.data['next'])
+
+    def test_search_term_too_short(self):
+        response = self.search(self.admin.data['token'], q='ku')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['message'], 'q must be at least 3 characters')
+
+    def test_search_non_admin(self):
+        response = self.search(self.non_admin.data['token'], q='kunle')
+        self.assertEqual(response.status_code, 401)
+
     def test_get_user_by_id(self):
         url = reverse('users-detail', args=(self.user3.pk,))
         view = FastPaceUserViewSet.as_view(
@@ -217,4 +330,104 @@ class TestFastPaceUser(APITestCase):
         self.assertEqual(response.data['message'], 'Profile photo deleted successfully')
     
 
+    def test_authenticated_user_served_from_cache(self):
+        url = reverse('users-detail', args=(self.user3.pk,))
+        view = FastPaceUserViewSet.as_view(
+            actions={
+                'get': 'retrieve',
+            }
+        )
+        view(self.factory.get(url, HTTP_AUTHORIZATION='JWT {}'.format(self.admin.data['token'])),
+             pk=self.user3.pk)
+
+        request = self.factory.get(url, HTTP_AUTHORIZATION='JWT {}'.format(self.admin.data['token']))
+        with self.assertNumQueries(1):
+            response = view(request, pk=self.user3.pk)
+        self.assertEqual(response.status_code, 200)
+
+    def test_deactivated_user_rejected_after_save(self):
+        url = reverse('users-detail', args=(self.user3.pk,))
+        view = FastPaceUserViewSet.as_view(
+            actions={
+                'get': 'retrieve',
+            }
+        )
+        view(self.factory.get(url, HTTP_AUTHORIZATION='JWT {}'.format(self.non_admin.data['token'])),
+             pk=self.user3.pk)
+
+        self.user3.is_active = False
+        self.user3.save()
+
+        request = self.factory.get(url, HTTP_AUTHORIZATION='JWT {}'.format(self.non_admin.data['token']))
+        response = view(request, pk=self.user3.pk)
+        self.assertEqual(response.status_code, 401)
+
+    def test_saving_cached_user_keeps_other_fields(self):
+        url = reverse('users-upload')
+        view = FastPaceUserViewSet.as_view(
+            actions={
+                'put': 'upload'
+            }
+        )
+        request = self.factory.put(url, data=dict(file='teddy1.jpg'), HTTP_AUTHORIZATION='JWT {}'.format(
+            self.non_admin.data['token']))
+        view(request)
+
+        self.user3.refresh_from_db()
+        self.assertEqual(self.user3.first_name, 'kunle')
+        self.assertEqual(self.user3.last_name, 'gold')
+
+
+class TestProfileThumbnails(APITestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.user = UserFactory(email='kunle@gmail.com', password='1234')
+        self.token = login_user(dict(email=self.user.email, password='1234')).data['token']
+        self.factory = APIRequestFactory()
+        self.view = FastPaceUserViewSet.as_view(actions={'put': 'upload'})
+
+    def upload_photo(self, size=(800, 600)):
+        buffer = io.BytesIO()
+        Image.new('RGB', size, 'blue').save(buffer, 'JPEG')
+        photo = SimpleUploadedFile('holiday.jpg', buffer.getvalue(), content_type='image/jpeg')
+        request = self.factory.put(reverse('users-upload'), data=dict(file=photo), format='multipart',
+                                   HTTP_AUTHORIZATION='JWT {}'.format(self.token))
+        return self.view(request)
+
+    def test_upload_returns_before_thumbnails_exist(self):
+        response = self.upload_photo()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.data['thumbnails'])
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.profile_photo.storage.exists(self.user.profile_photo.name))
+        self.assertFalse(self.user.photo_thumbnails_ready)
+
+    def test_thumbnails_generated_at_fixed_sizes(self):
+        self.upload_photo()
+        self.user.refresh_from_db()
+        generate_profile_thumbnails(self.user.pk, self.user.profile_photo.name)
+
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.photo_thumbnails_ready)
+        for label, size in settings.PROFILE_THUMBNAIL_SIZES:
+            with self.user.profile_photo.storage.open(self.user.thumbnail_name(label)) as thumbnail:
+                self.assertEqual(Image.open(thumbnail).size, size)
+        thumbnails = FileUploadSerializer(self.user).data['thumbnails']
+        self.assertEqual(set(thumbnails), {label for label, _ in settings.PROFILE_THUMBNAIL_SIZES})
+
+    def test_stale_thumbnails_not_marked_ready(self):
+        self.upload_photo()
+        self.user.refresh_from_db()
+        first_photo = self.user.profile_photo.name
+        self.upload_photo()
 
+        generate_profile_thumbnails(self.user.pk, first_photo)
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.photo_thumbnails_ready)
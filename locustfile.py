@@ -36,6 +36,12 @@ class UserBehavior(TaskSet):
             'Authorization': 'JWT {}'.format(self.token)
         })
 
+    @task(3)
+    def my_tickets(self):
+        self.client.get("/api/v1/ticket/mine/", headers={
+            'Authorization': 'JWT {}'.format(self.token)
+        })
+
 
 
 class WebsiteUser(HttpLocust):